@@ -1,6 +1,5 @@
 import os
 import logging
-import re
 from datetime import datetime
 from typing import Optional, Dict, Any, List
 
@@ -12,8 +11,9 @@ from pydantic import BaseModel
 from call.twilio import TwilioCallProvider                      # <-- Carrier Twilio
 from call.base import BaseCallProvider                          # <-- Tipos del carrier
 from voice.azure import AzureVoiceProvider                      # <-- TTS Azure
-from voice.elevenlabs import ElevenLabsVoiceProvider            # <-- TTS ElevenLabs
-from scheduler.openia import OpenAIConversationAssistant        # <-- Asistente (tool-calling puro)
+from voice.elevenlabs import ElevenLabsVoiceProvider, aclose_async_client  # <-- TTS ElevenLabs
+from voice.text import spoken_times                             # <-- AM/PM hablado (compartido)
+from scheduler.openia import OpenAIConversationAssistant, aclose_clients  # <-- Asistente (tool-calling puro)
 from scheduler.google_calendar import GoogleCalendarScheduler   # <-- Calendar
 from scheduler.bigquery_storage import BigQueryStorage          # <-- BigQuery (opcional)
 
@@ -32,6 +32,11 @@ if not BASE_URL:
 # Cache efímera de audio (clave: (call_id, seq) -> bytes)
 audio_cache: Dict[tuple, bytes] = {}
 
+# TTS_STREAMING=1: /audio sintetiza en streaming (si el proveedor lo soporta) en vez de esperar el audio completo.
+# Texto pendiente por reproducir (clave: (call_id, seq) -> texto)
+TTS_STREAMING = os.getenv("TTS_STREAMING", "0") == "1"
+pending_tts: Dict[tuple, str] = {}
+
 # Estado de llamada
 call_states: Dict[str, Dict[str, Any]] = {}
 
@@ -41,6 +46,12 @@ call_states: Dict[str, Dict[str, Any]] = {}
 assistant = OpenAIConversationAssistant()
 calendar = GoogleCalendarScheduler()
 
+@app.on_event("shutdown")
+async def _close_http_clients():
+    # Cierra los pools HTTP/2 de OpenAI y del TTS en streaming
+    await aclose_clients()
+    await aclose_async_client()
+
 # BigQuery es opcional
 bq: Optional[BigQueryStorage] = None
 try:
@@ -56,6 +67,10 @@ def get_call_provider() -> BaseCallProvider:
 # =========================
 # Utilidades anti-mojibake
 # =========================
+# Caracteres delatores de mojibake (el patrón AM/PM vive en voice/text.py)
+_MOJI_CHARS = frozenset("ÃÂâÎ")
+
+
 def _demojibake(text: str) -> str:
     """
     Repara texto típico con mojibake (UTF-8 leído como latin-1) sin afectar texto ya correcto.
@@ -63,24 +78,14 @@ def _demojibake(text: str) -> str:
     """
     if not text:
         return text
-    if any(ch in text for ch in ("Ã", "Â", "â", "Î")):
+    if not _MOJI_CHARS.isdisjoint(text):
         try:
             text = text.encode("latin-1").decode("utf-8")
         except Exception:
             pass
     
     # Corrección de AM/PM para mejor pronunciación
-    import re
-    # Captura tanto "AM/PM" como "a.m./p.m." con o sin espacios
-    text = re.sub(r'\b(\d{1,2}):?(\d{0,2})\s*(?:AM|a\.?\s*m\.?)\b', 
-                  lambda m: f"{m.group(1)}{':' + m.group(2) if m.group(2) else ''} de la mañana", 
-                  text, flags=re.IGNORECASE)
-    
-    text = re.sub(r'\b(\d{1,2}):?(\d{0,2})\s*(?:PM|p\.?\s*m\.?)\b', 
-                  lambda m: f"{m.group(1)}{':' + m.group(2) if m.group(2) else ''} de la tarde" 
-                           if int(m.group(1)) == 12 or int(m.group(1)) < 6 else 
-                           f"{m.group(1)}{':' + m.group(2) if m.group(2) else ''} de la noche", 
-                  text, flags=re.IGNORECASE)
+    text = spoken_times(text)
     
     return text
 
@@ -159,6 +164,14 @@ def speak_with_tts_and_build_twiml(call_id: str, text: str, gather_after: bool =
     text = _demojibake(text)
 
     vprov = get_voice_for_call(call_id)
+
+    if TTS_STREAMING and hasattr(vprov, "generate_audio_stream"):
+        # La síntesis ocurre cuando Twilio pide /audio: el primer byte sale sin esperar el audio completo
+        seq = next_seq(call_id)
+        pending_tts[(call_id, seq)] = text
+        token = vprov.create_tts_token(call_id, seq)
+        return build_play_twiml(f"{BASE_URL}/audio/{call_id}/{seq}?token={token}", gather_after=gather_after)
+
     audio = vprov.generate_audio(text)
     if not audio:
         logger.error("TTS devolvió audio vacío")
@@ -512,7 +525,7 @@ async def twilio_speech_result(request: Request):
         # DEBUG: Log del contexto para verificar qué se está pasando
         logger.info(f"[{call_sid}] Context keys: {list(context.keys())}")
         
-        reply = assistant.process(
+        reply = await assistant.aprocess(
             call_id=call_sid,
             user_text=speech_result,
             context=context,
@@ -622,6 +635,30 @@ async def serve_tts_audio(call_id: str, seq: int, token: str = Query(...)):
         raise HTTPException(status_code=401, detail="token inválido o expirado")
 
     key = (call_id, seq)
+    get_mime_type = getattr(vprov, "get_mime_type", lambda audio=None: "audio/wav")
+
+    # La entrada pendiente se conserva hasta tener el audio completo: si Twilio corta o reintenta a mitad del stream, se vuelve a sintetizar
+    text = pending_tts.get(key)
+    if text is not None and key not in audio_cache:
+        out: Dict[str, bytes] = {}
+        stream = vprov.generate_audio_stream(text, audio_out=out)
+        # Esperar el primer fragmento: si ElevenLabs falla no se responde un 200 vacío (Twilio sigue con el <Gather>)
+        first = await anext(stream, None)
+        if first is None:
+            logger.error("TTS en streaming no devolvió audio")
+            raise HTTPException(status_code=503, detail="TTS no disponible")
+
+        async def relay():
+            yield first
+            async for chunk in stream:
+                yield chunk
+            # Audio completo en la cache efímera: si Twilio vuelve a pedir la URL no se sintetiza de nuevo
+            if audio := out.get("audio"):
+                audio_cache[key] = audio
+                pending_tts.pop(key, None)
+
+        return StreamingResponse(relay(), media_type=get_mime_type(first))
+
     audio = audio_cache.get(key)
     if not audio:
         raise HTTPException(status_code=404, detail="audio no encontrado")
@@ -630,4 +667,4 @@ async def serve_tts_audio(call_id: str, seq: int, token: str = Query(...)):
     # audio_cache.pop(key, None)
 
     #return StreamingResponse(iter([audio]), media_type="audio/wav")
-    return StreamingResponse(iter([audio]), media_type=getattr(vprov, "get_mime_type", lambda: "audio/wav")())
+    return StreamingResponse(iter([audio]), media_type=get_mime_type(audio))
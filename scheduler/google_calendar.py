@@ -1,8 +1,9 @@
 import os
+import math
 import logging
 import datetime
-import random
 import pytz
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List, Dict, Any
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
@@ -10,12 +11,17 @@ from .base import BaseSchedulerProvider
 
 logger = logging.getLogger(__name__)
 
+_DIAS_SEMANA = ("Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo")
+
 class GoogleCalendarScheduler(BaseSchedulerProvider):
     """Proveedor de agendamiento usando Google Calendar - Completamente inteligente"""
     
-    def __init__(self, calendar_id: str = None, credentials_file: str = None):
+    def __init__(self, calendar_id: str = None, credentials_file: str = None, calendar_ids: List[str] = None):
         # Configuración desde variables de entorno
         self.calendar_id = calendar_id or os.getenv("CALENDAR_ID")
+        # Calendarios a consultar para disponibilidad (p. ej. uno por doctor); las citas se crean en calendar_id
+        ids_env = os.getenv("CALENDAR_IDS", "")
+        self.calendar_ids = calendar_ids or [c.strip() for c in ids_env.split(",") if c.strip()] or [self.calendar_id]
         self.credentials_file = credentials_file or os.getenv("GOOGLE_CREDENTIALS_FILE", "credentials.json")
         self.timezone = pytz.timezone('America/Bogota')  # UTC-5
         
@@ -33,20 +39,38 @@ class GoogleCalendarScheduler(BaseSchedulerProvider):
         doctores_env = os.getenv("DOCTORES_DISPONIBLES", "Dr. Martínez,Dra. Rodríguez,Dr. González")
         self.doctores = [doc.strip() for doc in doctores_env.split(",")]
         
+        # Rejilla de slots: cada bit representa un slot de intervalo_citas_minutos
+        # a partir de la hora de inicio de atención (ver _range_mask/_busy_mask)
+        self._inicio_min = self.hora_inicio_atencion * 60
+        fin_min = self.hora_fin_atencion * 60 + self.minutos_fin_atencion
+        self._slots_por_dia = max(0, (fin_min - self._inicio_min) // self.intervalo_citas_minutos + 1)
+        self._day_mask = (1 << self._slots_por_dia) - 1
+        
+        # Semana lunes..domingo: bit (dia * slots_por_dia + k) = slot k de un día de atención
+        self._working_mask = 0
+        for dia in self.dias_atencion:
+            self._working_mask |= self._day_mask << (dia * self._slots_por_dia)
+        
         # Validar configuración
         if not self.calendar_id:
             raise ValueError("CALENDAR_ID debe estar configurado en las variables de entorno")
         
         logger.info(f"📅 Configuración Calendar:")
         logger.info(f"  - Calendar ID: {self.calendar_id}")
+        if len(self.calendar_ids) > 1:
+            logger.info(f"  - Calendarios de disponibilidad: {self.calendar_ids}")
         logger.info(f"  - Horario: {self.hora_inicio_atencion}:00 - {self.hora_fin_atencion}:{self.minutos_fin_atencion:02d}")
         logger.info(f"  - Duración citas: {self.duracion_cita_minutos} min")
         logger.info(f"  - Doctores: {self.doctores}")
     
     def _generate_time_slots(self, fecha_dia: datetime.datetime) -> List[Dict[str, Any]]:
-        """Genera todos los slots de tiempo posibles para un día específico"""
+        """Genera todos los slots de tiempo posibles para un día específico (siempre con zona horaria)"""
         slots = []
         
+        # Localizar una sola vez por día (pytz requiere localize, no tzinfo=)
+        if fecha_dia.tzinfo is None:
+            fecha_dia = self.timezone.localize(fecha_dia)
+        
         # Empezar desde la hora de inicio
         hora_actual = fecha_dia.replace(
             hour=self.hora_inicio_atencion, 
@@ -73,6 +97,64 @@ class GoogleCalendarScheduler(BaseSchedulerProvider):
         
         return slots
     
+    def _range_mask(self, weekday_inicio: int, num_dias: int) -> int:
+        """Máscara de slots de atención para num_dias días consecutivos desde weekday_inicio"""
+        spd = self._slots_por_dia
+        corte = weekday_inicio * spd
+        
+        # Rotar la semana para que el bit 0 sea el primer slot de weekday_inicio
+        semana = (self._working_mask >> corte) | (
+            (self._working_mask & ((1 << corte) - 1)) << (7 * spd - corte))
+        
+        mask = 0
+        for dia_offset in range(0, num_dias, 7):
+            mask |= semana << (dia_offset * spd)
+        return mask & ((1 << (num_dias * spd)) - 1)
+    
+    def _busy_mask(self, eventos_ocupados: List[Dict[str, Any]], origen: datetime.datetime, num_dias: int) -> int:
+        """Marca como ocupados (OR) los slots que se solapan con algún evento"""
+        spd = self._slots_por_dia
+        intervalo = self.intervalo_citas_minutos * 60
+        duracion = self.duracion_cita_minutos * 60
+        busy = 0
+        
+        for evento in eventos_ocupados:
+            # Segundos desde la medianoche del primer día
+            ini = math.floor((evento['inicio'] - origen).total_seconds())
+            fin = math.ceil((evento['fin'] - origen).total_seconds())
+            
+            for dia_offset in range(max(0, ini // 86400), min(num_dias, (fin - 1) // 86400 + 1)):
+                base = dia_offset * 86400 + self._inicio_min * 60
+                # Solapamiento: inicio_slot < fin_evento AND fin_slot > inicio_evento
+                lo = max(0, (ini - base - duracion) // intervalo + 1)
+                hi = min(spd, -((base - fin) // intervalo))
+                if hi > lo:
+                    busy |= ((1 << (hi - lo)) - 1) << (dia_offset * spd + lo)
+        
+        return busy
+    
+    @staticmethod
+    def _fmt_slot(dt: datetime.datetime) -> tuple:
+        """Retorna (hora 12h 'H:MM AM/PM', fecha 'D/M/AAAA') sin strftime: '%-I'/'%-d' no existen en Windows"""
+        return (f"{dt.hour % 12 or 12}:{dt.minute:02d} {'AM' if dt.hour < 12 else 'PM'}",
+                f"{dt.day}/{dt.month}/{dt.year}")
+    
+    def _make_slot_dict(self, hora_inicio: datetime.datetime, hora_fin: datetime.datetime, index: int) -> Dict[str, Any]:
+        """Construye el dict de un horario ofrecible; el doctor rota según index"""
+        dia_semana = _DIAS_SEMANA[hora_inicio.weekday()]
+        hora_str, fecha_mostrar = self._fmt_slot(hora_inicio)
+        
+        return {
+            'fecha_hora': hora_inicio,
+            'texto': f"{dia_semana} {fecha_mostrar} a las {hora_str}",
+            'doctor': self.doctores[index % len(self.doctores)],
+            'fecha_mostrar': fecha_mostrar,
+            'iso_inicio': hora_inicio.isoformat(),
+            'iso_fin': hora_fin.isoformat(),
+            'dia_semana': dia_semana,
+            'hora_12h': hora_str
+        }
+    
     def _get_calendar_service(self):
         """Obtiene un servicio autenticado para Google Calendar"""
         try:
@@ -85,6 +167,22 @@ class GoogleCalendarScheduler(BaseSchedulerProvider):
             logger.error(f"Error al configurar servicio de Google Calendar: {e}")
             return None
     
+    def _list_events(self, service, calendar_id: str, time_min: str, time_max: str) -> List[Dict[str, Any]]:
+        """Lista los eventos de un calendario en el rango; si service es None crea uno propio"""
+        if service is None:
+            service = self._get_calendar_service()
+            if not service:
+                raise RuntimeError(f"No se pudo conectar con Google Calendar ({calendar_id})")
+        
+        eventos = service.events().list(
+            calendarId=calendar_id,
+            timeMin=time_min,
+            timeMax=time_max,
+            singleEvents=True,
+            orderBy='startTime'
+        ).execute()
+        return eventos.get('items', [])
+    
     def get_available_appointments(self, days_ahead: int = 5) -> List[Dict[str, Any]]:
         """Obtiene citas disponibles de forma completamente inteligente"""
         try:
@@ -100,15 +198,19 @@ class GoogleCalendarScheduler(BaseSchedulerProvider):
             logger.info(f"🔍 Buscando disponibilidad desde {ahora.strftime('%Y-%m-%d %H:%M')} hasta {tiempo_fin.strftime('%Y-%m-%d %H:%M')}")
             
             # Obtener TODOS los eventos existentes en el rango
-            eventos = service.events().list(
-                calendarId=self.calendar_id,
-                timeMin=ahora.isoformat(),
-                timeMax=tiempo_fin.isoformat(),
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
+            time_min, time_max = ahora.isoformat(), tiempo_fin.isoformat()
+            if len(self.calendar_ids) > 1:
+                # Una petición HTTPS por calendario, en paralelo: el tiempo total es el de la más lenta.
+                # Solo el primer hilo reutiliza `service`; los demás crean el suyo (httplib2 no es thread-safe)
+                services = [service] + [None] * (len(self.calendar_ids) - 1)
+                with ThreadPoolExecutor(max_workers=min(8, len(self.calendar_ids))) as pool:
+                    resultados = pool.map(
+                        lambda args: self._list_events(args[0], args[1], time_min, time_max),
+                        zip(services, self.calendar_ids))
+                    eventos_lista = [evento for items in resultados for evento in items]
+            else:
+                eventos_lista = self._list_events(service, self.calendar_ids[0], time_min, time_max)
             
-            eventos_lista = eventos.get('items', [])
             logger.info(f"📅 Eventos encontrados en calendar: {len(eventos_lista)}")
             
             # Procesar TODOS los eventos ocupados
@@ -134,97 +236,49 @@ class GoogleCalendarScheduler(BaseSchedulerProvider):
                             'titulo': titulo
                         })
                         
-                        logger.info(f"  📋 Ocupado: {inicio_dt.strftime('%a %d/%m %H:%M')} - {fin_dt.strftime('%H:%M')} ({titulo})")
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug("  📋 Ocupado: %s - %s (%s)",
+                                         inicio_dt.strftime('%a %d/%m %H:%M'), fin_dt.strftime('%H:%M'), titulo)
                     except Exception as e:
                         logger.error(f"❌ Error al procesar evento: {e}")
             
-            # Generar TODOS los horarios disponibles de forma inteligente
+            # Generar TODOS los horarios disponibles con máscaras de bits:
+            # disponibles = slots de atención AND NOT ocupados
+            num_dias = days_ahead + 1
+            origen = ahora.replace(hour=0, minute=0, second=0, microsecond=0)
+            spd = self._slots_por_dia
+            
+            atencion = self._range_mask(ahora.weekday(), num_dias)
+            
+            # Para hoy, al menos 1 hora de anticipación (desde la próxima hora en punto)
+            hora_minima = (ahora + datetime.timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
+            seg_minimos = (hora_minima - origen).total_seconds() - self._inicio_min * 60
+            k_min = min(spd, max(0, math.ceil(seg_minimos / (self.intervalo_citas_minutos * 60))))
+            atencion &= ~((1 << k_min) - 1)
+            
+            ocupados = self._busy_mask(eventos_ocupados, origen, num_dias)
+            disponibles = atencion & ~ocupados
+            
+            logger.info(f"📅 Slots de atención: {atencion.bit_count()} · ocupados: {(atencion & ocupados).bit_count()}")
+            
             horarios_disponibles = []
             
-            # Para cada día en el rango
-            for dia_offset in range(days_ahead + 1):
-                dia_actual = (ahora + datetime.timedelta(days=dia_offset)).replace(
-                    hour=0, minute=0, second=0, microsecond=0)
-                
-                # Solo días de atención (lunes a viernes por defecto)
-                if dia_actual.weekday() not in self.dias_atencion:
-                    continue
-                
-                # Si es el día actual, no considerar horarios que ya pasaron
-                if dia_offset == 0:
-                    # Para hoy, empezar desde la próxima hora disponible
-                    hora_minima = ahora + datetime.timedelta(hours=1)  # Al menos 1 hora de anticipación
-                    hora_minima = hora_minima.replace(minute=0, second=0, microsecond=0)
-                    if hora_minima.minute > 0:
-                        hora_minima = hora_minima.replace(minute=30 if hora_minima.minute <= 30 else 0)
-                        if hora_minima.minute == 0:
-                            hora_minima += datetime.timedelta(hours=1)
-                else:
-                    hora_minima = None
+            # Recorrer los bits disponibles de menor a mayor (orden cronológico)
+            while disponibles:
+                bajo = disponibles & -disponibles
+                disponibles ^= bajo
+                dia_offset, k = divmod(bajo.bit_length() - 1, spd)
                 
-                # Generar slots de tiempo para este día
-                slots_del_dia = self._generate_time_slots(dia_actual)
+                hora_inicio = origen + datetime.timedelta(
+                    minutes=dia_offset * 1440 + self._inicio_min + k * self.intervalo_citas_minutos)
+                hora_fin = hora_inicio + datetime.timedelta(minutes=self.duracion_cita_minutos)
                 
-                logger.info(f"📅 Analizando {dia_actual.strftime('%A %d/%m/%Y')} - {len(slots_del_dia)} slots posibles")
+                horario_info = self._make_slot_dict(hora_inicio, hora_fin, len(horarios_disponibles))
+                horarios_disponibles.append(horario_info)
                 
-                for slot in slots_del_dia:
-                    hora_inicio = slot['hora_inicio']
-                    hora_fin = slot['hora_fin']
-                    
-                    # Asegurar zona horaria
-                    if hora_inicio.tzinfo is None:
-                        hora_inicio = self.timezone.localize(hora_inicio)
-                        hora_fin = self.timezone.localize(hora_fin)
-                    
-                    # Saltar si es muy pronto (mismo día)
-                    if hora_minima and hora_inicio < hora_minima:
-                        continue
-                    
-                    # Verificar si está disponible (no hay conflictos)
-                    disponible = True
-                    conflicto_con = None
-                    
-                    for evento in eventos_ocupados:
-                        # Verificar solapamiento: (inicio1 < fin2) AND (fin1 > inicio2)
-                        if (hora_inicio < evento['fin'] and hora_fin > evento['inicio']):
-                            disponible = False
-                            conflicto_con = evento['titulo']
-                            break
-                    
-                    if disponible:
-                        # Formatear información del horario
-                        dia_semana = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", 
-                                      "Sábado", "Domingo"][hora_inicio.weekday()]
-                        
-                        fecha_mostrar = f"{hora_inicio.day}/{hora_inicio.month}/{hora_inicio.year}"
-                        
-                        # Formato 12h
-                        if hora_inicio.hour < 12:
-                            hora_str = f"{hora_inicio.hour}:{hora_inicio.minute:02d} AM"
-                        elif hora_inicio.hour == 12:
-                            hora_str = f"12:{hora_inicio.minute:02d} PM"
-                        else:
-                            hora_str = f"{hora_inicio.hour-12}:{hora_inicio.minute:02d} PM"
-                        
-                        # Asignar doctor de forma inteligente (rotativo)
-                        doctor = self.doctores[len(horarios_disponibles) % len(self.doctores)]
-                        
-                        horario_info = {
-                            'fecha_hora': hora_inicio,
-                            'texto': f"{dia_semana} {fecha_mostrar} a las {hora_str}",
-                            'doctor': doctor,
-                            'fecha_mostrar': fecha_mostrar,
-                            'iso_inicio': hora_inicio.isoformat(),
-                            'iso_fin': hora_fin.isoformat(),
-                            'dia_semana': dia_semana,
-                            'hora_12h': hora_str
-                        }
-                        
-                        horarios_disponibles.append(horario_info)
-                        
-                        logger.info(f"  ✅ Disponible: {dia_semana} {fecha_mostrar} {hora_str} con {doctor}")
-                    else:
-                        logger.info(f"  ❌ Ocupado: {hora_inicio.strftime('%H:%M')} (conflicto con: {conflicto_con})")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("  ✅ Disponible: %s %s %s con %s", horario_info['dia_semana'],
+                                 horario_info['fecha_mostrar'], horario_info['hora_12h'], horario_info['doctor'])
             
             logger.info(f"🎯 Total horarios disponibles encontrados: {len(horarios_disponibles)}")
             
@@ -241,18 +295,20 @@ class GoogleCalendarScheduler(BaseSchedulerProvider):
     
     def _select_best_appointments(self, horarios_disponibles: List[Dict]) -> List[Dict]:
         """Selecciona los mejores horarios de forma inteligente"""
-        # Agrupar por día
+        # Agrupar por día solo los 3 primeros días (los horarios llegan en orden cronológico)
         horarios_por_dia = {}
         for horario in horarios_disponibles:
-            fecha_clave = horario['fecha_hora'].strftime("%Y-%m-%d")
+            fecha_clave = horario['fecha_hora'].date()
             if fecha_clave not in horarios_por_dia:
+                if len(horarios_por_dia) == 3:
+                    break
                 horarios_por_dia[fecha_clave] = []
             horarios_por_dia[fecha_clave].append(horario)
         
         horarios_seleccionados = []
         
         # Seleccionar hasta 3 días diferentes
-        for fecha, horarios_del_dia in list(horarios_por_dia.items())[:3]:
+        for fecha, horarios_del_dia in horarios_por_dia.items():
             # Preferir horarios de la mañana (9-12) y tarde temprana (14-16)
             horarios_preferidos = []
             horarios_otros = []
@@ -264,11 +320,11 @@ class GoogleCalendarScheduler(BaseSchedulerProvider):
                 else:
                     horarios_otros.append(horario)
             
-            # Elegir de los preferidos si existen, sino de los otros
+            # Elegir el más temprano de los preferidos si existen, sino de los otros
             if horarios_preferidos:
-                horario_elegido = random.choice(horarios_preferidos)
+                horario_elegido = horarios_preferidos[0]
             elif horarios_otros:
-                horario_elegido = random.choice(horarios_otros)
+                horario_elegido = horarios_otros[0]
             else:
                 continue
             
@@ -282,9 +338,6 @@ class GoogleCalendarScheduler(BaseSchedulerProvider):
                     if len(horarios_seleccionados) >= 3:
                         break
         
-        # Aleatorizar el orden final
-        random.shuffle(horarios_seleccionados)
-        
         logger.info(f"🎯 Horarios seleccionados para ofrecer: {len(horarios_seleccionados)}")
         for h in horarios_seleccionados:
             logger.info(f"  📅 {h['texto']} con {h['doctor']}")
@@ -309,39 +362,7 @@ class GoogleCalendarScheduler(BaseSchedulerProvider):
             slots_del_dia = self._generate_time_slots(dia)
             
             for slot in slots_del_dia:
-                hora_inicio = slot['hora_inicio']
-                hora_fin = slot['hora_fin']
-                
-                if hora_inicio.tzinfo is None:
-                    hora_inicio = self.timezone.localize(hora_inicio)
-                    hora_fin = self.timezone.localize(hora_fin)
-                
-                # Formatear información
-                dia_semana = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", 
-                              "Sábado", "Domingo"][hora_inicio.weekday()]
-                
-                fecha_mostrar = f"{hora_inicio.day}/{hora_inicio.month}/{hora_inicio.year}"
-                
-                # Formato 12h
-                if hora_inicio.hour < 12:
-                    hora_str = f"{hora_inicio.hour}:{hora_inicio.minute:02d} AM"
-                elif hora_inicio.hour == 12:
-                    hora_str = f"12:{hora_inicio.minute:02d} PM"
-                else:
-                    hora_str = f"{hora_inicio.hour-12}:{hora_inicio.minute:02d} PM"
-                
-                doctor = self.doctores[len(horarios_todos) % len(self.doctores)]
-                
-                horarios_todos.append({
-                    'fecha_hora': hora_inicio,
-                    'texto': f"{dia_semana} {fecha_mostrar} a las {hora_str}",
-                    'doctor': doctor,
-                    'fecha_mostrar': fecha_mostrar,
-                    'iso_inicio': hora_inicio.isoformat(),
-                    'iso_fin': hora_fin.isoformat(),
-                    'dia_semana': dia_semana,
-                    'hora_12h': hora_str
-                })
+                horarios_todos.append(self._make_slot_dict(slot['hora_inicio'], slot['hora_fin'], len(horarios_todos)))
         
         # Usar la misma lógica de selección inteligente
         return self._select_best_appointments(horarios_todos)
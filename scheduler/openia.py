@@ -2,19 +2,99 @@
 # Asistente conversacional con Tool Calling (Contrato A)
 
 import os
-import json
+import re
+import time
+import asyncio
+import hashlib
 import logging
-from typing import Optional, Dict, Any, List
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple
 
-from openai import OpenAI
+import httpx
+import orjson
+from openai import AsyncOpenAI
+
+from voice.text import spoken_times
 
 logger = logging.getLogger(__name__)
 
+# Clientes OpenAI reutilizados por proceso (clave: (api_key, base_url))
+_CLIENTS: Dict[tuple, AsyncOpenAI] = {}
+
+# Límite de llamadas concurrentes al LLM por proceso (todas las llamadas telefónicas comparten el event loop)
+_LLM_SEMA = asyncio.Semaphore(int(os.getenv("OPENAI_MAX_CONCURRENCY", "32")))
+
+
+def _get_client(api_key: str, base_url: Optional[str]) -> AsyncOpenAI:
+    key = (api_key, base_url)
+    client = _CLIENTS.get(key)
+    if client is None:
+        # HTTP/2 + pool amplio: las llamadas concurrentes multiplexan sobre conexiones ya abiertas
+        http_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=100),
+            timeout=httpx.Timeout(30.0, connect=5.0),
+        )
+        client = AsyncOpenAI(api_key=api_key, base_url=base_url or None, http_client=http_client)
+        _CLIENTS[key] = client
+    return client
+
+
+async def aclose_clients() -> None:
+    """Cierra los clientes OpenAI del proceso (y su pool HTTP). Llamar al apagar la app."""
+    clients = list(_CLIENTS.values())
+    _CLIENTS.clear()
+    for client in clients:
+        await client.close()
+
+
+# Caché de respuestas exactas (REPLY_CACHE=1): capacidad y vigencia
+_REPLY_CACHE_MAX = 512
+_REPLY_CACHE_TTL = 600  # segundos
+
+# Elección directa de una opción ofrecida ("1", "la segunda", "opción 3."): toda la frase debe ser la elección
+_CHOICE_RE = re.compile(r"^\s*(?:la\s+)?(?:opci[oó]n\s+)?(1|2|3|primer[ao]?|segund[ao]|tercer[ao]?)(?:\s+opci[oó]n)?\W*$")
+_CHOICE_IDX = {
+    "1": 0, "primer": 0, "primera": 0, "primero": 0,
+    "2": 1, "segunda": 1, "segundo": 1,
+    "3": 2, "tercer": 2, "tercera": 2, "tercero": 2,
+}
+
+# Fast-path FAQ: solo preguntas ("¿...?" o interrogativo al inicio) y nunca con negación o cierre
+_QUESTION_RE = re.compile(r"[¿?]|^(?:y\s+)?(?:d[oó]nde|cu[aá]l|qu[eé]|c[oó]mo|tienen|hay)\b")
+_DECLINE_RE = re.compile(r"\b(?:no|gracias|hasta luego|chao|adi[oó]s)\b")
+# Palabras de FAQ demasiado genéricas para el fast-path ("¿de dónde me llama?" no pregunta por la dirección)
+_FAQ_VAGUE = frozenset({"dónde", "donde"})
+
+# Tope de generación por ronda: las respuestas habladas son de una o dos frases
+_MAX_TOKENS = 120
+
+# Intención de agendar en el turno de apertura (dispara el prefetch de get_slots)
+_SCHEDULE_INTENT_RE = re.compile(r"agendar|cita|horario|turno")
+
+# Respuestas previas del asistente más largas que esto (tokens estimados) no se reenvían en el historial
+_HISTORY_MAX_TOKENS = 200
+
+# Fin de frase para el streaming a TTS (sin cortar en "Dr." / "Dra." ni tras un token de una letra: "a. m." / "p. m.")
+_SENTENCE_END_RE = re.compile(r"(?<!Dr)(?<!Dra)(?<!\b\w)[.!?]\s")
+_STREAM_CHUNK_CHARS = 60
+# Hora posiblemente incompleta al final del buffer ("8:00", "8:00 a.", "8:00 a. m."): no cortar dentro de ella
+_TIME_TAIL_RE = re.compile(r"\b\d{1,2}(?::\d{0,2})?\s*(?:[ap]\.?\s*(?:m\.?)?)?$", re.IGNORECASE)
+
+# Frases de cierre que terminan la llamada (coincidencia por subcadena)
+_END_CALL_RE = re.compile("hasta luego|gracias|feliz día|buen día")
+
 
 def _norm(t: Optional[str]) -> str:
     return (t or "").strip().lower()
 
 
+async def _spoken_pieces(pieces: AsyncIterator[str]) -> AsyncIterator[str]:
+    # AM/PM → "de la mañana/tarde/noche" por frase antes del TTS (misma regla que _demojibake en app.py)
+    async for piece in pieces:
+        yield spoken_times(piece)
+
+
 def _limit_words(text: str, max_words: int = 150) -> str:
     words = (text or "").split()
     if len(words) <= max_words:
@@ -35,17 +115,22 @@ class OpenAIConversationAssistant:
         }
     """
 
+    # El self-test (OPENAI_SELFTEST=1 u OPENAI_SMOKE_TEST=1) corre a lo sumo una vez por proceso
+    _validated = False
+
     def __init__(self, api_key: Optional[str] = None, model: Optional[str] = None):
         api_key = api_key or os.getenv("OPENAI_API_KEY", "").strip()
         if not api_key:
             raise RuntimeError("OPENAI_API_KEY no configurada.")
         base_url = os.getenv("OPENAI_BASE_URL", "").strip() or None
 
-        self.client = OpenAI(api_key=api_key) if not base_url else OpenAI(api_key=api_key, base_url=base_url)
-        _ = self.client.models.list()  # smoke test
-
+        self.client = _get_client(api_key, base_url)
         self.model = model or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
+        # Caché LRU+TTL de respuestas para mensajes idénticos ("sí", "repíteme"...): clave -> (expira, reply)
+        self._reply_cache_enabled = os.getenv("REPLY_CACHE", "0") == "1"
+        self._reply_cache: "OrderedDict[bytes, tuple]" = OrderedDict()
+
         self.faq = {
             "direccion": "Calle 123 #45-67, Medellín (Barrio Laureles).",
             "sede": "Nuestra sede principal está en Laureles, Medellín.",
@@ -55,6 +140,30 @@ class OpenAIConversationAssistant:
             "parqueadero": "Sí, contamos con parqueadero propio (cupo limitado).",
         }
 
+        # FAQ: una sola regex con un grupo por tema; el orden de _faq_order define la prioridad
+        faq_keywords = {
+            "dir": ["dirección", "direccion", "ubica", "ubicación", "dónde", "donde", "cómo llegar", "como llegar"],
+            "sede": ["sede"],
+            "hor": ["horario", "hora", "atienden", "sabado", "sábado", "sábados", "sabados"],
+            "tel": ["tel", "telefono", "teléfono", "whatsapp", "wasap", "cel", "celular"],
+            "parq": ["parqueadero", "parqueo", "parquear"],
+        }
+        self._faq_order = {name: i for i, name in enumerate(faq_keywords)}
+        self._faq_re = re.compile(
+            "|".join(
+                f"(?P<{name}>" + "|".join(re.escape(k) for k in sorted(kws, key=len, reverse=True)) + ")"
+                for name, kws in faq_keywords.items()
+            ),
+            re.IGNORECASE,
+        )
+        self._faq_answers = {
+            "dir": self.faq["direccion"],
+            "sede": self.faq["sede"],
+            "hor": self.faq["horario"],
+            "tel": f"Tel: {self.faq['telefono']} · WhatsApp: {self.faq['whatsapp']}",
+            "parq": self.faq["parqueadero"],
+        }
+
         self.tools = [
             {
                 "type": "function",
@@ -101,17 +210,42 @@ class OpenAIConversationAssistant:
             }
         ]
 
+        # Partes estáticas del request serializadas una sola vez: las tools viajan en extra_body como JSON
+        # plano, así el SDK no re-valida/transforma el esquema completo en cada llamada (solo messages cambia)
+        self._static_body = {"tools": orjson.loads(orjson.dumps(self.tools))}
+
+        # Prompt de sistema ESTÁTICO: byte-idéntico en todos los turnos y llamadas para que el
+        # prefix caching automático de OpenAI (>1024 tokens, tools incluidas) lo reutilice.
+        # Todo lo dinámico (historial, nombre, slots ofrecidos) va DESPUÉS, en mensajes user/tool.
         self.system_prompt = (
             "Eres Salomé (español colombiano), amable, cordial y breve. Objetivo: agendar cita.\n"
-            "CONTEXTO IMPORTANTE: Si hay un 'nombre_paciente' en el contexto, ESE ES EL PACIENTE que llama, NO un doctor.\n"
-            "Los doctores disponibles son los que aparecen en los slots (Dr. Martínez, etc.).\n"
-            "NUNCA confundas el nombre del paciente con el nombre de un doctor.\n"
+            "\n"
+            "Identidad del paciente:\n"
+            " - El mensaje actual del usuario llega prefijado con 'NOMBRE: ' (p. ej. 'Ana Pérez: sí, quiero la cita').\n"
+            " - Ese NOMBRE es el del PACIENTE que llama, NO el de un doctor. Si el nombre es 'Cliente', no lo conoces.\n"
+            " - Los doctores disponibles son los que aparecen en los slots (Dr. Martínez, etc.).\n"
+            " - NUNCA confundas el nombre del paciente con el nombre de un doctor.\n"
+            " - Puedes llamar al paciente por su nombre de pila, con naturalidad y sin repetirlo en cada frase.\n"
+            "\n"
+            "Opciones ofrecidas:\n"
+            " - Si ya se ofrecieron horarios, antes del mensaje del usuario llega una línea 'Opciones vigentes: 0:ISO_INICIO:DOCTOR | 1:... | 2:...'.\n"
+            " - El número antes del primer ':' (0, 1, 2) es el índice que debes usar en 'schedule'; ISO_INICIO es la fecha/hora exacta de esa opción.\n"
+            " - 'la primera' / 'la uno' corresponde al índice 0, 'la segunda' al 1 y 'la tercera' al 2.\n"
+            " - Si el usuario menciona un día, una hora o un doctor de esa lista, usa el índice de esa opción.\n"
+            " - Si no hay esa línea, aún no has ofrecido horarios: usa 'get_slots' antes de proponer fechas.\n"
             "\n"
             "Puedes usar funciones cuando lo necesites:\n"
             " - get_slots: consulta horarios reales y ofrece 2-3 opciones claras.\n"
             " - answer_faq: responde dirección/horarios/teléfono/WhatsApp/parqueadero; tras responder, vuelve a ofrecer agendamiento.\n"
             " - schedule: confirma la cita (por índice de las opciones ofrecidas o por ISO si el usuario lo especifica).\n"
             "\n"
+            "Uso de funciones:\n"
+            " - No inventes horarios: solo ofrece los que devuelva 'get_slots' o los que ya estén en Opciones vigentes.\n"
+            " - Llama 'get_slots' una sola vez por turno; si ya hay opciones ofrecidas, reutilízalas salvo que pida otras.\n"
+            " - Llama 'schedule' solo cuando el usuario haya elegido claramente una opción; si duda, pregunta cuál prefiere.\n"
+            " - Nunca digas que la cita quedó agendada antes de llamar 'schedule'; el sistema confirma el resultado.\n"
+            " - Si el usuario pide un horario que no está entre las opciones, ofrece las más cercanas disponibles.\n"
+            "\n"
             "Reglas:\n"
             " - Responde en UNA sola oración corta (≤150 palabras), natural, cordial y concreta.\n"
             " - Si el usuario ya eligió horario (por índice, día/hora o frase libre), intenta llamar 'schedule'.\n"
@@ -119,11 +253,17 @@ class OpenAIConversationAssistant:
             " - Si el usuario habla de algo irrelevante, responde amablemente y guíalo hacia el agendamiento.\n"
             " - Si pregunta algo dentro de FAQs, usa 'answer_faq' y retoma el agendamiento.\n"
             " - Si no quiere agendar, despídete cordialmente y termina.\n"
+            " - La conversación es telefónica: no uses listas, viñetas, emojis, enlaces ni formato; solo texto para ser leído en voz alta.\n"
+            " - Si no entendiste lo que dijo el usuario, pídele amablemente que lo repita.\n"
             "\n"
             "Estilo de fecha/hora:\n"
             " - NUNCA leas fechas en formato numérico; convierte a natural: 'martes 26 de agosto a las 8:00 a. m.'\n"
             " - Usa meses en palabras (enero… diciembre) y reloj de 12 horas con 'a. m.' / 'p. m.'\n"
+            "\n"
+            "Información de la sede (la misma que devuelve 'answer_faq'):\n"
+            + "".join(f" - {k}: {v}\n" for k, v in self.faq.items())
         )
+        self._system_message = {"role": "system", "content": self.system_prompt}
 
     # ---------------- Tool handlers (backend) ----------------
 
@@ -140,18 +280,24 @@ class OpenAIConversationAssistant:
         ]
         return {"slots": simple}
 
+    def _faq_hits(self, q: str, whole_words: bool = False) -> List["re.Match"]:
+        """Coincidencias de FAQ en q (una pasada de la regex compilada)."""
+        if not whole_words:
+            return list(self._faq_re.finditer(q))
+        # Solo palabras completas: evita p. ej. 'cel' dentro de 'cancelar'
+        return [
+            m for m in self._faq_re.finditer(q)
+            if (m.start() == 0 or not q[m.start() - 1].isalnum()) and (m.end() == len(q) or not q[m.end()].isalnum())
+        ]
+
+    def _faq_buckets(self, q: str, whole_words: bool = False) -> set:
+        """Temas de FAQ mencionados en q."""
+        return {m.lastgroup for m in self._faq_hits(q, whole_words)}
+
     def _tool_answer_faq(self, query: str) -> Dict[str, Any]:
-        q = _norm(query)
-        if any(k in q for k in ["dirección", "direccion", "ubica", "ubicación", "dónde", "donde", "cómo llegar", "como llegar"]):
-            a = f"{self.faq['direccion']}"
-        elif any(k in q for k in ["sede"]):
-            a = f"{self.faq['sede']}"
-        elif any(k in q for k in ["horario", "hora", "atienden", "sabado", "sábado", "sábados", "sabados"]):
-            a = f"{self.faq['horario']}"
-        elif any(k in q for k in ["tel", "telefono", "teléfono", "whatsapp", "wasap", "cel", "celular"]):
-            a = f"Tel: {self.faq['telefono']} · WhatsApp: {self.faq['whatsapp']}"
-        elif any(k in q for k in ["parqueadero", "parqueo", "parquear"]):
-            a = f"{self.faq['parqueadero']}"
+        buckets = self._faq_buckets(_norm(query))
+        if buckets:
+            a = self._faq_answers[min(buckets, key=self._faq_order.__getitem__)]
         else:
             a = "Puedo ayudarte con dirección, horarios, teléfonos, WhatsApp y parqueadero."
         return {"answer": a}
@@ -164,111 +310,260 @@ class OpenAIConversationAssistant:
             "iso_fin": args.get("iso_fin"),
         }}
 
+    # ---------------- Caché de respuestas ----------------
+
+    @staticmethod
+    def _reply_cache_key(messages: List[Dict[str, Any]]) -> bytes:
+        return hashlib.sha1(orjson.dumps(messages, option=orjson.OPT_SORT_KEYS)).digest()
+
+    def _reply_cache_get(self, key: bytes) -> Optional[Dict[str, Any]]:
+        entry = self._reply_cache.get(key)
+        if entry is None:
+            return None
+        expires, reply = entry
+        if time.monotonic() > expires:
+            del self._reply_cache[key]
+            return None
+        self._reply_cache.move_to_end(key)
+        return dict(reply)
+
+    def _reply_cache_put(self, key: bytes, reply: Dict[str, Any]) -> None:
+        self._reply_cache[key] = (time.monotonic() + _REPLY_CACHE_TTL, dict(reply))
+        self._reply_cache.move_to_end(key)
+        while len(self._reply_cache) > _REPLY_CACHE_MAX:
+            self._reply_cache.popitem(last=False)
+
+    # ---------------- Atajos locales (sin LLM) ----------------
+
+    def _local_reply(self, call_id: str, user_text: str, offered_slots: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Resuelve sin LLM los turnos triviales: elección directa de una opción ofrecida
+        o una pregunta corta de FAQ con un único tema. None si ninguna regla aplica.
+        """
+        q = _norm(user_text)
+
+        if offered_slots:
+            m = _CHOICE_RE.match(q)
+            if m and _CHOICE_IDX[m.group(1)] < len(offered_slots):
+                idx = _CHOICE_IDX[m.group(1)]
+                logger.info(f"[{call_id}] fast-path schedule index={idx}")
+                doctor = offered_slots[idx].get("doctor")
+                return {
+                    "say_text": f"Perfecto, agendo tu cita con {doctor}." if doctor else "Perfecto, agendo tu cita.",
+                    "actions": [self._tool_schedule({"index": idx})["action"]],
+                    "end_call": False,
+                    "slots": offered_slots,
+                }
+
+        # Solo preguntas cortas sobre un único tema, sin negación ni cierre ("no gracias, no tengo celular" va al LLM).
+        # 'hor' se excluye: "¿a qué hora?" suele ser parte del agendamiento, no la FAQ de horario de atención
+        hits = self._faq_hits(q, whole_words=True)
+        buckets = {m.lastgroup for m in hits}
+        if len(buckets) == 1 and "hor" not in buckets and len(q.split()) <= 8 and not _DECLINE_RE.search(q):
+            bucket = next(iter(buckets))
+            words = {m.group() for m in hits}
+            if words <= _FAQ_VAGUE or not (q.strip(" ¿?¡!.,") in words or _QUESTION_RE.search(q)):
+                return None
+            logger.info(f"[{call_id}] fast-path faq={bucket}")
+            follow_up = "¿Cuál de los horarios que te propuse prefieres?" if offered_slots else "¿Te gustaría agendar tu cita?"
+            reply: Dict[str, Any] = {
+                "say_text": f"{self._faq_answers[bucket]} {follow_up}",
+                "actions": [],
+                "end_call": False,
+            }
+            if offered_slots:
+                reply["slots"] = offered_slots
+            return reply
+
+        return None
+
     # ---------------- Orquestación principal ----------------
 
-    def process(self, call_id: str, user_text: str, context: Dict[str, Any], calendar=None) -> Dict[str, Any]:
-        nombre_paciente = (context or {}).get("nombre_paciente") or "Cliente"
-        history: List[Dict[str, str]] = (context or {}).get("history", [])
-        offered_slots = (context or {}).get("slots", [])
+    def _build_messages(self, nombre_paciente: str, user_text: str,
+                        history: List[Dict[str, str]], offered_slots: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        messages = [self._system_message]
 
-        messages = [{"role": "system", "content": self.system_prompt}]
-        
-        # Agregar contexto explícito sobre el paciente ANTES del historial
-        if nombre_paciente and nombre_paciente != "Cliente":
-            messages.append({
-                "role": "system", 
-                "content": f"CONTEXTO: El paciente que llama se llama {nombre_paciente}. Este NO es un doctor, es el PACIENTE que necesita agendar una cita."
-            })
-        
-        # Agregar historial
+        # Agregar historial (se omiten respuestas largas del asistente: ~len//4 tokens)
         for h in history[-2:]:
             if u := h.get("user"):
                 messages.append({"role": "user", "content": u})
-            if a := h.get("assistant"):
+            if (a := h.get("assistant")) and len(a) // 4 <= _HISTORY_MAX_TOKENS:
                 messages.append({"role": "assistant", "content": a})
-        
-        # Mensaje actual del usuario
-        messages.append({"role": "user", "content": f"{nombre_paciente}: {user_text}"})
 
+        # Opciones ofrecidas en forma compacta (índice:iso_inicio:doctor), después del prefijo estático
         if offered_slots:
+            compact = " | ".join(f"{i}:{s.get('iso_inicio')}:{s.get('doctor')}" for i, s in enumerate(offered_slots))
+            messages.append({"role": "user", "content": f"Opciones vigentes: {compact}"})
+
+        messages.append({"role": "user", "content": f"{nombre_paciente}: {user_text}"})
+        return messages
+
+    async def _run_tool_calls(self, content: Optional[str], tool_calls: List[Dict[str, str]],
+                              messages: List[Dict[str, Any]], actions: List[Dict[str, Any]],
+                              cache: Dict[str, Any], calendar) -> Optional[List[Dict[str, Any]]]:
+        """
+        Registra el mensaje del asistente con sus tool_calls ({id, name, arguments}), ejecuta cada una
+        y agrega su respuesta role="tool". Devuelve los slots nuevos si se llamó get_slots.
+        """
+        # 🔴🔴🔴 IMPORTANTE: añade el MENSAJE DEL ASISTENTE con sus tool_calls
+        # para que los siguientes mensajes role="tool" sean válidos
+        messages.append({
+            "role": "assistant",
+            "content": content or "",
+            "tool_calls": [
+                {
+                    "id": tc["id"],
+                    "type": "function",
+                    "function": {
+                        "name": tc["name"],
+                        "arguments": tc["arguments"] or "{}",
+                    },
+                }
+                for tc in tool_calls
+            ],
+        })
+
+        # Ejecutar las tool_calls en paralelo; los role="tool" se agregan en el orden original
+        results = await asyncio.gather(*(self._dispatch_tool(tc, cache, calendar) for tc in tool_calls))
+
+        new_slots = None
+        for tc, result in zip(tool_calls, results):
+            fname = tc["name"]
+            if result is None:
+                continue
+            if fname == "get_slots":
+                new_slots = result.get("slots", [])
+            elif fname == "schedule":
+                actions.append(result["action"])
+                result = {"ok": True, "queued": True}
+
             messages.append({
-                "role": "system",
-                "content": f"Slots_ofrecidos_actualmente={json.dumps(offered_slots, ensure_ascii=False)}"
+                "role": "tool",
+                "tool_call_id": tc["id"],
+                "name": fname,
+                "content": orjson.dumps(result).decode()
             })
 
-        say_text, actions, end_call = None, [], False
+        return new_slots
+
+    async def _dispatch_tool(self, tc: Dict[str, str], cache: Dict[str, Any], calendar) -> Optional[Dict[str, Any]]:
+        fname = tc["name"]
+        fargs = orjson.loads(tc["arguments"] or "{}")
+
+        if fname == "get_slots":
+            # Se guarda la tarea (no el resultado) para que get_slots repetidos en el mismo turno compartan una sola consulta.
+            # Calendar es bloqueante (HTTP síncrono): ejecutarlo fuera del event loop
+            if "get_slots" not in cache:
+                prefetch = cache.pop("_prefetch_slots", None)
+                if prefetch is not None and fargs.get("days_ahead", 5) == 5:
+                    cache["get_slots"] = prefetch
+                else:
+                    cache["get_slots"] = asyncio.ensure_future(asyncio.to_thread(self._tool_get_slots, calendar, **fargs))
+                    self._discard_prefetch(cache, prefetch)
+            return await cache["get_slots"]
+        if fname == "answer_faq":
+            return self._tool_answer_faq(fargs.get("query", ""))
+        if fname == "schedule":
+            return self._tool_schedule(fargs)
+        return None
+
+    def _prefetch_slots(self, call_id: str, user_text: str, offered_slots: List[Dict[str, Any]],
+                        calendar, cache: Dict[str, Any]) -> None:
+        """
+        Turno de apertura con intención de agendar: casi seguro el modelo pedirá get_slots,
+        así que la consulta al calendario arranca en paralelo con la primera llamada al LLM.
+        """
+        if offered_slots or calendar is None or not _SCHEDULE_INTENT_RE.search(_norm(user_text)):
+            return
+        logger.info(f"[{call_id}] prefetch get_slots")
+        task = asyncio.ensure_future(asyncio.to_thread(self._tool_get_slots, calendar, 5))
+        # Si nadie la espera, que un error del calendario no quede como "exception was never retrieved"
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        cache["_prefetch_slots"] = task
+
+    @staticmethod
+    def _discard_prefetch(cache: Dict[str, Any], task=None) -> None:
+        task = task or cache.pop("_prefetch_slots", None)
+        if task is not None:
+            task.cancel()
+
+    @staticmethod
+    def _build_reply(say_text: Optional[str], actions: List[Dict[str, Any]],
+                     offered_slots: List[Dict[str, Any]]) -> Dict[str, Any]:
+        reply: Dict[str, Any] = {
+            "say_text": say_text or "¿Te gustaría agendar una cita? Puedo proponerte horarios.",
+            "actions": actions,
+            "end_call": bool(say_text and _END_CALL_RE.search(_norm(say_text))),
+        }
+        if offered_slots:
+            reply["slots"] = offered_slots
+        return reply
+
+    async def _ensure_validated(self) -> None:
+        """Self-test opcional (OPENAI_SELFTEST=1 u OPENAI_SMOKE_TEST=1): models.list() a lo sumo una vez por proceso, en la primera llamada."""
+        if OpenAIConversationAssistant._validated or "1" not in (os.getenv("OPENAI_SELFTEST"), os.getenv("OPENAI_SMOKE_TEST")):
+            return
+        try:
+            _ = await self.client.models.list()
+            OpenAIConversationAssistant._validated = True
+            logger.info("✅ OpenAI client listo. Modelo por defecto: %s", self.model)
+        except Exception as e:
+            logger.error(f"❌ OpenAI client no pasó self-test: {repr(e)}")
+            raise RuntimeError(
+                "OpenAI no operativo. Revisa OPENAI_API_KEY, OPENAI_BASE_URL (si aplica), conectividad y permisos."
+            )
+
+    async def aprocess(self, call_id: str, user_text: str, context: Dict[str, Any], calendar=None) -> Dict[str, Any]:
+        await self._ensure_validated()
+
+        nombre_paciente = (context or {}).get("nombre_paciente") or "Cliente"
+        history: List[Dict[str, str]] = (context or {}).get("history", [])
+        offered_slots = (context or {}).get("slots", [])
+
+        local = self._local_reply(call_id, user_text, offered_slots)
+        if local is not None:
+            return local
+
+        messages = self._build_messages(nombre_paciente, user_text, history, offered_slots)
+
+        cache_key = None
+        if self._reply_cache_enabled:
+            cache_key = self._reply_cache_key(messages)
+            cached = self._reply_cache_get(cache_key)
+            if cached is not None:
+                logger.info(f"[{call_id}] reply cache hit")
+                return cached
+
+        say_text, actions = None, []
         tool_runs = 0
         cache: Dict[str, Any] = {}
+        # La respuesta es una o dos frases: cortar si el modelo empieza otro párrafo o simula el turno del paciente
+        stop = ["\n\n", "\nPaciente:", f"\n{nombre_paciente}:"]
+        self._prefetch_slots(call_id, user_text, offered_slots, calendar, cache)
 
         while tool_runs < 3:
-            resp = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.4,
-                tools=self.tools,
-                tool_choice="auto",
-                max_tokens=200,
-            )
+            async with _LLM_SEMA:
+                resp = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=0.4,
+                    tool_choice="auto",
+                    max_tokens=_MAX_TOKENS,
+                    stop=stop,
+                    extra_body=self._static_body,
+                )
             msg = resp.choices[0].message
             tool_calls = getattr(msg, "tool_calls", None)
 
             if tool_calls:
                 tool_runs += 1
-
-                # 🔴🔴🔴 IMPORTANTE: añade el MENSAJE DEL ASISTENTE con sus tool_calls
-                # para que los siguientes mensajes role="tool" sean válidos
-                assistant_with_tools = {
-                    "role": "assistant",
-                    "content": msg.content or "",
-                    "tool_calls": [
-                        {
-                            "id": tc.id,
-                            "type": "function",
-                            "function": {
-                                "name": tc.function.name,
-                                "arguments": tc.function.arguments or "{}",
-                            },
-                        }
-                        for tc in tool_calls
-                    ],
-                }
-                messages.append(assistant_with_tools)  # <-- IMPORTANTE: registrar assistant con tool_calls
-
-                # Ejecutar cada tool_call y responder con role="tool"
-                for tc in tool_calls:
-                    fname = tc.function.name
-                    fargs = json.loads(tc.function.arguments or "{}")
-
-                    if fname == "get_slots":
-                        if "get_slots" not in cache:
-                            cache["get_slots"] = self._tool_get_slots(calendar, **fargs)
-                        result = cache["get_slots"]
-                        offered_slots = result.get("slots", [])
-                        messages.append({
-                            "role": "tool",
-                            "tool_call_id": tc.id,
-                            "name": fname,
-                            "content": json.dumps(result, ensure_ascii=False)
-                        })
-
-                    elif fname == "answer_faq":
-                        result = self._tool_answer_faq(fargs.get("query", ""))
-                        messages.append({
-                            "role": "tool",
-                            "tool_call_id": tc.id,
-                            "name": fname,
-                            "content": json.dumps(result, ensure_ascii=False)
-                        })
-
-                    elif fname == "schedule":
-                        result = self._tool_schedule(fargs)
-                        actions.append(result["action"])
-                        messages.append({
-                            "role": "tool",
-                            "tool_call_id": tc.id,
-                            "name": fname,
-                            "content": json.dumps({"ok": True, "queued": True}, ensure_ascii=False)
-                        })
+                new_slots = await self._run_tool_calls(
+                    msg.content,
+                    [{"id": tc.id, "name": tc.function.name, "arguments": tc.function.arguments} for tc in tool_calls],
+                    messages, actions, cache, calendar,
+                )
+                if new_slots is not None:
+                    offered_slots = new_slots
 
                 # Iteración siguiente: el modelo verá los tool-results y redactará
                 continue
@@ -278,17 +573,145 @@ class OpenAIConversationAssistant:
             if candidate:
                 say_text = _limit_words(candidate, 150)
             break
+        self._discard_prefetch(cache)
 
-        if say_text and any(x in _norm(say_text) for x in ["hasta luego", "gracias", "feliz día", "buen día"]):
-            end_call = True
+        reply = self._build_reply(say_text, actions, offered_slots)
 
-        reply: Dict[str, Any] = {
-            "say_text": say_text or "¿Te gustaría agendar una cita? Puedo proponerte horarios.",
-            "actions": actions,
-            "end_call": end_call
-        }
-        if offered_slots:
-            reply["slots"] = offered_slots
+        # No cachear turnos con efectos (schedule) ni los que trajeron slots nuevos (invalidan la respuesta)
+        if cache_key is not None and not actions and "get_slots" not in cache:
+            self._reply_cache_put(cache_key, reply)
 
         logger.info(f"[{call_id}] reply={ {k: (v if k!='slots' else f'{len(v)} slots') for k,v in reply.items()} }")
         return reply
+
+    # ---------------- Streaming (texto → TTS por frases) ----------------
+
+    async def astream_text(self, call_id: str, user_text: str, context: Dict[str, Any], calendar=None,
+                           reply_out: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """
+        Igual que aprocess(), pero con stream=True: emite el texto final por frases
+        (fin de frase o ~60 chars) a medida que llega, para sintetizar mientras el modelo sigue generando.
+        Si se pasa reply_out, al terminar se llena con el dict de respuesta completo (acciones, slots, end_call).
+        """
+        await self._ensure_validated()
+
+        nombre_paciente = (context or {}).get("nombre_paciente") or "Cliente"
+        history: List[Dict[str, str]] = (context or {}).get("history", [])
+        offered_slots = (context or {}).get("slots", [])
+
+        reply = self._local_reply(call_id, user_text, offered_slots)
+        messages = None
+        if reply is None:
+            messages = self._build_messages(nombre_paciente, user_text, history, offered_slots)
+            if self._reply_cache_enabled:
+                reply = self._reply_cache_get(self._reply_cache_key(messages))
+                if reply is not None:
+                    logger.info(f"[{call_id}] reply cache hit")
+
+        if reply is not None:
+            if reply_out is not None:
+                reply_out.update(reply)
+            yield reply["say_text"]
+            return
+
+        actions: List[Dict[str, Any]] = []
+        cache: Dict[str, Any] = {}
+        # La respuesta es una o dos frases: cortar si el modelo empieza otro párrafo o simula el turno del paciente
+        stop = ["\n\n", "\nPaciente:", f"\n{nombre_paciente}:"]
+        self._prefetch_slots(call_id, user_text, offered_slots, calendar, cache)
+        parts: List[str] = []
+        buf = ""
+        tool_runs = 0
+
+        while tool_runs < 3:
+            tool_calls: Dict[int, Dict[str, str]] = {}
+            content = ""
+            async with _LLM_SEMA:
+                stream = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=0.4,
+                    tool_choice="auto",
+                    max_tokens=_MAX_TOKENS,
+                    stop=stop,
+                    extra_body=self._static_body,
+                    stream=True,
+                )
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+
+                    # Las tool_calls llegan fragmentadas: acumular por índice
+                    for tc in (getattr(delta, "tool_calls", None) or []):
+                        acc = tool_calls.setdefault(tc.index, {"id": "", "name": "", "arguments": ""})
+                        if tc.id:
+                            acc["id"] = tc.id
+                        if tc.function and tc.function.name:
+                            acc["name"] += tc.function.name
+                        if tc.function and tc.function.arguments:
+                            acc["arguments"] += tc.function.arguments
+
+                    if not delta.content:
+                        continue
+                    content += delta.content
+                    if tool_calls:
+                        continue
+
+                    buf += delta.content
+                    m = None
+                    for m in _SENTENCE_END_RE.finditer(buf):
+                        pass
+                    if m is not None:
+                        cut = m.end()
+                    elif len(buf) >= _STREAM_CHUNK_CHARS and buf.rfind(" ") > 0:
+                        cut = buf.rfind(" ")
+                        # Retroceder si el corte dejaría una hora a medias ("8:00 a." | "m. con...")
+                        if t := _TIME_TAIL_RE.search(buf[:cut].rstrip()):
+                            cut = buf.rfind(" ", 0, t.start())
+                            if cut <= 0:
+                                continue
+                    else:
+                        continue
+                    if piece := buf[:cut].strip():
+                        parts.append(piece)
+                        yield piece
+                    buf = buf[cut:]
+
+            if tool_calls:
+                tool_runs += 1
+                new_slots = await self._run_tool_calls(
+                    content, [tool_calls[i] for i in sorted(tool_calls)], messages, actions, cache, calendar,
+                )
+                if new_slots is not None:
+                    offered_slots = new_slots
+                continue
+            break
+        self._discard_prefetch(cache)
+
+        if tail := buf.strip():
+            parts.append(tail)
+            yield tail
+
+        reply = self._build_reply(" ".join(parts) or None, actions, offered_slots)
+        if not parts:
+            yield reply["say_text"]
+        if reply_out is not None:
+            reply_out.update(reply)
+        logger.info(f"[{call_id}] reply(stream)={ {k: (v if k!='slots' else f'{len(v)} slots') for k,v in reply.items()} }")
+
+    async def aprocess_stream(self, call_id: str, user_text: str, context: Dict[str, Any], voice, calendar=None,
+                              reply_out: Optional[Dict[str, Any]] = None) -> AsyncIterator[Tuple[bytes, bool]]:
+        """
+        Texto en streaming → voice.synthesize_stream(). Emite (audio_bytes, is_final);
+        el primer fragmento es un WAV completo y los siguientes solo su cuerpo de audio.
+        Cada frase pasa por la corrección AM/PM antes del TTS, igual que el camino con buffer.
+        """
+        prev = None
+        pieces = _spoken_pieces(self.astream_text(call_id, user_text, context, calendar, reply_out))
+        async for audio in voice.synthesize_stream(pieces):
+            if prev is not None:
+                yield prev, False
+            prev = audio
+        if prev is not None:
+            yield prev, True
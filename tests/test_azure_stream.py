@@ -0,0 +1,36 @@
+# AzureVoiceProvider.synthesize_stream: un solo WAV de streaming, sin cabeceras RIFF intermedias
+
+import asyncio
+import struct
+
+import pytest
+
+pytest.importorskip("azure.cognitiveservices.speech")
+
+from voice.azure import AzureVoiceProvider
+
+
+def _mulaw_wav(data: bytes) -> bytes:
+    fmt = struct.pack("<HHIIHHH", 0x0007, 1, 8000, 8000, 1, 8, 0)
+    body = b"WAVE" + b"fmt " + struct.pack("<I", len(fmt)) + fmt + b"data" + struct.pack("<I", len(data)) + data
+    return b"RIFF" + struct.pack("<I", len(body)) + body
+
+
+def test_stream_strips_riff_header_from_later_chunks():
+    audio = {"uno": b"\x01" * 10, "dos": b"\x02" * 6, "tres": b"\x03" * 4}
+    provider = AzureVoiceProvider.__new__(AzureVoiceProvider)
+    provider._synthesize_wav_mulaw = lambda texto, velocidad, tono: _mulaw_wav(audio[texto])
+
+    async def texts():
+        for texto in audio:
+            yield texto
+
+    async def run():
+        return [chunk async for chunk in provider.synthesize_stream(texts())]
+
+    first, *rest = asyncio.run(run())
+    header_len = len(_mulaw_wav(b""))
+    assert first[:4] == b"RIFF" and first[4:8] == b"\xff\xff\xff\xff"
+    assert first[header_len - 8:header_len] == b"data\xff\xff\xff\xff"
+    assert first[header_len:] == audio["uno"]
+    assert rest == [audio["dos"], audio["tres"]]
@@ -0,0 +1,129 @@
+# Formato de salida de ElevenLabsVoiceProvider: el MIME y la cabecera deben corresponder a los bytes
+
+import asyncio
+import struct
+
+import pytest
+
+for _mod in ("requests", "httpx", "orjson", "numpy"):
+    pytest.importorskip(_mod)
+
+from voice.elevenlabs import ElevenLabsVoiceProvider, _AUDIO_CACHE
+
+# Frame MPEG-1 Layer III 128 kbps 44.1 kHz precedido de etiqueta ID3, y sin ella
+MP3_ID3 = b"ID3\x04\x00\x00\x00\x00\x00\x00" + b"\xff\xfb\x90\x44" + b"\x00" * 64
+MP3_FRAME = b"\xff\xfb\x90\x44" + b"\x00" * 64
+# μ-law: el silencio es 0xFF, que comparte los 11 bits de sync con MP3
+ULAW_SILENCE = b"\xff" * 160
+
+
+class _Resp:
+    def __init__(self, content: bytes, content_type: str):
+        self.status_code = 200
+        self.content = content
+        self.headers = {"Content-Type": content_type}
+
+
+class _Session:
+    def __init__(self, resp: _Resp):
+        self.resp = resp
+        self.urls = []
+
+    def post(self, url, **kwargs):
+        self.urls.append(url)
+        return self.resp
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    monkeypatch.setenv("ELEVENLABS_API_KEY", "test")
+    monkeypatch.setenv("ELEVENLABS_VOICE_ID", "voz")
+    monkeypatch.setenv("ELEVENLABS_OUTPUT_FORMAT", "ulaw_8000")
+    _AUDIO_CACHE.clear()
+    yield ElevenLabsVoiceProvider()
+    _AUDIO_CACHE.clear()
+
+
+def test_output_format_goes_in_the_query_string(provider):
+    assert provider._tts_url.endswith("/stream?output_format=ulaw_8000")
+    assert "output_format" not in provider._base_payload
+
+
+def test_ulaw_is_wrapped_as_mulaw_wav(provider):
+    provider._session = _Session(_Resp(ULAW_SILENCE, "audio/basic"))
+    audio = provider.generate_audio("hola")
+    assert provider._session.urls == [provider._tts_url]
+    assert audio[:4] == b"RIFF" and audio[8:12] == b"WAVE"
+    assert struct.unpack_from("<H", audio, 20)[0] == 0x0007  # WAVE_FORMAT_MULAW
+    assert audio.endswith(ULAW_SILENCE)
+    assert provider.get_mime_type(audio) == "audio/wav"
+
+
+@pytest.mark.parametrize("body, content_type", [
+    (MP3_ID3, "audio/mpeg"),
+    (MP3_FRAME, "audio/mpeg"),
+    (MP3_FRAME, "application/octet-stream"),
+])
+def test_mp3_response_passes_through_unchanged(provider, body, content_type):
+    provider._session = _Session(_Resp(body, content_type))
+    audio = provider.generate_audio("hola")
+    assert audio == body
+    assert provider.get_mime_type(audio) == "audio/mpeg"
+
+
+def test_mp3_sniffing_rejects_ulaw_silence():
+    assert not ElevenLabsVoiceProvider._looks_like_mp3(ULAW_SILENCE)
+    assert ElevenLabsVoiceProvider._looks_like_mp3(MP3_FRAME)
+
+
+class _AsyncStreamResp:
+    def __init__(self, chunks, content_type: str):
+        self.status_code = 200
+        self.headers = {"Content-Type": content_type}
+        self._chunks = chunks
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def aiter_bytes(self, chunk_size):
+        for chunk in self._chunks:
+            yield chunk
+
+
+class _AsyncClient:
+    def __init__(self, resp: _AsyncStreamResp):
+        self.resp = resp
+        self.headers = None
+
+    def stream(self, method, url, content=None, headers=None):
+        self.headers = headers
+        return self.resp
+
+
+def _collect_stream(provider, monkeypatch, chunks, content_type):
+    client = _AsyncClient(_AsyncStreamResp(chunks, content_type))
+    monkeypatch.setattr("voice.elevenlabs._get_async_client", lambda: client)
+    out = {}
+
+    async def run():
+        return [c async for c in provider.generate_audio_stream("hola", audio_out=out)]
+
+    return asyncio.run(run()), out, client
+
+
+def test_stream_ulaw_gets_streaming_wav_header(provider, monkeypatch):
+    streamed, out, client = _collect_stream(provider, monkeypatch, [ULAW_SILENCE[:80], ULAW_SILENCE[80:]], "audio/basic")
+    assert streamed[0][:4] == b"RIFF" and b"".join(streamed[1:]) == ULAW_SILENCE
+    assert provider.get_mime_type(streamed[0]) == "audio/wav"
+    assert out["audio"].endswith(ULAW_SILENCE) and out["audio"][4:8] != b"\xff\xff\xff\xff"
+    assert client.headers == {"xi-api-key": "test", "Content-Type": "application/json", "Accept": "application/octet-stream"}
+
+
+def test_stream_mp3_is_relayed_without_wav_header(provider, monkeypatch):
+    streamed, out, _ = _collect_stream(provider, monkeypatch, [MP3_FRAME[:10], MP3_FRAME[10:]], "audio/mpeg")
+    assert b"".join(streamed) == MP3_FRAME
+    assert provider.get_mime_type(streamed[0]) == "audio/mpeg"
+    assert out["audio"] == MP3_FRAME
@@ -0,0 +1,43 @@
+# Casos del atajo local (sin LLM) de OpenAIConversationAssistant._local_reply
+
+import pytest
+
+pytest.importorskip("openai")
+
+from scheduler.openia import OpenAIConversationAssistant
+
+
+@pytest.fixture
+def assistant(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    return OpenAIConversationAssistant()
+
+
+@pytest.mark.parametrize("text", [
+    "no gracias, no tengo celular",
+    "¿de dónde me llama?",
+    "de dónde es usted",
+    "mi teléfono está dañado",
+    "no, la dirección ya la tengo",
+    "gracias por la dirección",
+])
+def test_faq_fast_path_skips_non_questions(assistant, text):
+    assert assistant._local_reply("t", text, []) is None
+
+
+@pytest.mark.parametrize("text, answer", [
+    ("¿cuál es la dirección?", "Calle 123"),
+    ("dirección", "Calle 123"),
+    ("¿tienen parqueadero?", "parqueadero"),
+    ("y el whatsapp?", "WhatsApp"),
+])
+def test_faq_fast_path_answers_questions(assistant, text, answer):
+    reply = assistant._local_reply("t", text, [])
+    assert reply is not None and answer in reply["say_text"]
+    assert reply["end_call"] is False
+
+
+def test_choice_fast_path_schedules_offered_slot(assistant):
+    slots = [{"doctor": "Dr. A"}, {"doctor": "Dr. B"}]
+    reply = assistant._local_reply("t", "la segunda", slots)
+    assert reply["actions"] == [{"type": "schedule", "index": 1, "iso_inicio": None, "iso_fin": None}]
@@ -0,0 +1,75 @@
+# Texto en streaming de OpenAIConversationAssistant: cortes por frase y corrección AM/PM antes del TTS
+
+import asyncio
+import re
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("openai")
+
+from scheduler.openia import OpenAIConversationAssistant
+
+REPLY = "Perfecto, tengo una opción a las 8:00 a. m. con el Dr. Martínez, ¿te sirve? También hay a las 3:30 p. m. con la Dra. Gómez."
+
+
+class _Completions:
+    def __init__(self, text: str, step: int):
+        self.text = text
+        self.step = step
+
+    async def create(self, **kwargs):
+        async def stream():
+            for i in range(0, len(self.text), self.step):
+                delta = SimpleNamespace(content=self.text[i:i + self.step], tool_calls=None)
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+        return stream()
+
+
+class _Voice:
+    def __init__(self):
+        self.pieces = []
+
+    async def synthesize_stream(self, chunks):
+        async for texto in chunks:
+            self.pieces.append(texto)
+            yield texto.encode("utf-8")
+
+
+@pytest.fixture
+def assistant(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    return OpenAIConversationAssistant()
+
+
+def _stream_pieces(assistant, step):
+    assistant.client = SimpleNamespace(chat=SimpleNamespace(completions=_Completions(REPLY, step)))
+    out = {}
+
+    async def run():
+        return [p async for p in assistant.astream_text("t", "hola, buenas", {}, reply_out=out)]
+
+    return asyncio.run(run()), out
+
+
+@pytest.mark.parametrize("step", [1, 3, 7, 16, 200])
+def test_splitter_keeps_am_pm_times_whole(assistant, step):
+    pieces, out = _stream_pieces(assistant, step)
+    assert " ".join(pieces) == REPLY == out["say_text"]
+    for piece in pieces:
+        assert not re.search(r"\d\s*[ap]\.?$", piece), pieces
+        assert not re.match(r"m\.", piece), pieces
+
+
+def test_stream_pieces_are_normalised_before_tts(assistant):
+    assistant.client = SimpleNamespace(chat=SimpleNamespace(completions=_Completions(REPLY, 7)))
+    voice = _Voice()
+
+    async def run():
+        return [chunk async for chunk in assistant.aprocess_stream("t", "hola, buenas", {}, voice)]
+
+    chunks = asyncio.run(run())
+    spoken = " ".join(voice.pieces)
+    assert "8:00 de la mañana" in spoken and "3:30 de la tarde" in spoken
+    assert "a. m." not in spoken and "p. m." not in spoken
+    assert chunks[-1][1] is True and all(not final for _, final in chunks[:-1])
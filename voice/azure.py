@@ -1,14 +1,41 @@
 import os
+import re
+import asyncio
 import logging
+import queue
 import hmac
 import hashlib
 import time
-from typing import Optional
+from typing import Optional, AsyncIterator
 import azure.cognitiveservices.speech as speechsdk
 from .base import BaseVoiceProvider
 
 logger = logging.getLogger(__name__)
 
+# Escape XML en una sola pasada (mismo resultado que html.escape)
+_SSML_ESCAPE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#x27;"})
+
+# Ajustes mínimos útiles en telefonía + micro-pausas, todos en una sola sustitución
+_SSML_SUBS = {
+    "Dr.": "Doctor",
+    "Dra.": "Doctora",
+    "AM": "A M",
+    "PM": "P M",
+    ",": ", <break time='200ms'/>",
+    "?": " <break time='250ms'/>?",
+}
+_SSML_SUBS_RE = re.compile(r"Dra\.|Dr\.|AM|PM|,|\?")
+
+_SSML_TEMPLATE = (
+    '<speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xml:lang="es-CO">\n'
+    '  <voice name="{voz}">\n'
+    '    <prosody rate="{rate}" pitch="{pitch}">\n'
+    '      {body}\n'
+    '    </prosody>\n'
+    '  </voice>\n'
+    '</speak>'
+)
+
 
 class AzureVoiceProvider:
     """
@@ -27,10 +54,27 @@ class AzureVoiceProvider:
         # Seguridad para endpoints efímeros de TTS
         self.tts_secret = os.getenv("TTS_SECRET", "change-me-in-production")
         self.tts_token_ttl = int(os.getenv("TTS_TOKEN_TTL_SECONDS", "300"))  # 5 min por defecto
+        # HMAC con la clave ya cargada: cada firma copia el prototipo en vez de recalcular los pads
+        self._tts_secret_bytes = self.tts_secret.encode("utf-8")
+        self._hmac_prototype = hmac.new(self._tts_secret_bytes, digestmod=hashlib.sha256)
 
         if not self.subscription_key:
             raise RuntimeError("AZURE_SUBSCRIPTION_KEY requerida")
 
+        # Config y synthesizer se crean una vez y se reutilizan (conexión persistente del SDK).
+        # Un synthesizer no admite síntesis concurrentes: se prestan desde un pool y
+        # solo se crea otro cuando todos están ocupados (p. ej. synthesize_stream).
+        self._speech_config = speechsdk.SpeechConfig(
+            subscription=self.subscription_key,
+            region=self.region,
+        )
+        # WAV RIFF 8kHz μ-law (Twilio-friendly)
+        self._speech_config.set_speech_synthesis_output_format(
+            speechsdk.SpeechSynthesisOutputFormat.Riff8Khz8BitMonoMULaw
+        )
+        self._synth_pool: "queue.SimpleQueue[speechsdk.SpeechSynthesizer]" = queue.SimpleQueue()
+        self._synth_pool.put(self._new_synthesizer())
+
         logger.info(f"Azure TTS listo: voz={self.voice_name} región={self.region}")
 
     # ---------------------------------------------------------------------
@@ -63,9 +107,55 @@ class AzureVoiceProvider:
         """Alias corto que usa los defaults recomendados."""
         return self._synthesize_wav_mulaw(texto, velocidad=1.2, tono=2)
 
+    async def synthesize_stream(
+        self,
+        chunks: AsyncIterator[str],
+        velocidad: float = 1.2,
+        tono: int = 2,
+    ) -> AsyncIterator[bytes]:
+        """
+        Sintetiza cada fragmento de texto apenas llega (en paralelo con el productor)
+        y emite el audio en orden: el primero como WAV completo con tamaños "de streaming"
+        y los siguientes sin cabecera RIFF, de modo que concatenados forman un único WAV μ-law.
+        """
+        pending: asyncio.Queue = asyncio.Queue()
+
+        async def produce():
+            try:
+                async for texto in chunks:
+                    await pending.put(asyncio.create_task(
+                        asyncio.to_thread(self._synthesize_wav_mulaw, texto, velocidad, tono)
+                    ))
+            finally:
+                await pending.put(None)
+
+        producer = asyncio.create_task(produce())
+        first = True
+        try:
+            while (task := await pending.get()) is not None:
+                wav = await task
+                if not wav:
+                    continue
+                offset = self._wav_data_offset(wav)
+                if first:
+                    first = False
+                    yield self._streaming_header(wav, offset) + wav[offset:]
+                else:
+                    yield wav[offset:]
+            await producer  # propaga errores del productor
+        finally:
+            producer.cancel()
+
     # ---------------------------------------------------------------------
     # IMPLEMENTACIÓN
     # ---------------------------------------------------------------------
+    def _new_synthesizer(self) -> "speechsdk.SpeechSynthesizer":
+        # Synthesizer sin dispositivo de salida: recibimos bytes en result.audio_data
+        return speechsdk.SpeechSynthesizer(
+            speech_config=self._speech_config,
+            audio_config=None,
+        )
+
     def _synthesize_wav_mulaw(self, texto: str, velocidad: float, tono: int) -> Optional[bytes]:
         if not texto or not texto.strip():
             logger.warning("Azure TTS: texto vacío")
@@ -80,22 +170,6 @@ class AzureVoiceProvider:
             tono = 2
 
         try:
-            speech_config = speechsdk.SpeechConfig(
-                subscription=self.subscription_key,
-                region=self.region,
-            )
-
-            # WAV RIFF 8kHz μ-law (Twilio-friendly)
-            speech_config.set_speech_synthesis_output_format(
-                speechsdk.SpeechSynthesisOutputFormat.Riff8Khz8BitMonoMULaw
-            )
-
-            # Synthesizer sin dispositivo de salida: recibimos bytes en result.audio_data
-            synthesizer = speechsdk.SpeechSynthesizer(
-                speech_config=speech_config,
-                audio_config=None,
-            )
-
             ssml = self._build_ssml(
                 texto=self._clean_text(texto),
                 voz=self.voice_name,
@@ -103,7 +177,14 @@ class AzureVoiceProvider:
                 tono=tono,
             )
 
-            result = synthesizer.speak_ssml_async(ssml).get()
+            try:
+                synthesizer = self._synth_pool.get_nowait()
+            except queue.Empty:
+                synthesizer = self._new_synthesizer()
+            try:
+                result = synthesizer.speak_ssml_async(ssml).get()
+            finally:
+                self._synth_pool.put(synthesizer)
 
             if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
                 logger.info(
@@ -123,6 +204,25 @@ class AzureVoiceProvider:
             logger.error(f"Azure TTS error: {e}")
             return None
 
+    @staticmethod
+    def _wav_data_offset(wav: bytes) -> int:
+        """Offset del audio dentro de un WAV RIFF (tras la cabecera del chunk 'data')."""
+        pos = 12
+        while pos + 8 <= len(wav):
+            size = int.from_bytes(wav[pos + 4:pos + 8], "little")
+            if wav[pos:pos + 4] == b"data":
+                return pos + 8
+            pos += 8 + size + (size & 1)
+        return 0
+
+    @staticmethod
+    def _streaming_header(wav: bytes, offset: int) -> bytes:
+        """Cabecera del primer WAV con tamaños RIFF/data en 0xFFFFFFFF (longitud desconocida)."""
+        if offset < 8:
+            return wav[:offset]
+        unknown = b"\xff\xff\xff\xff"
+        return wav[:4] + unknown + wav[8:offset - 4] + unknown
+
     # ---------------------------------------------------------------------
     # SSML / LIMPIEZA
     # ---------------------------------------------------------------------
@@ -131,47 +231,18 @@ class AzureVoiceProvider:
         Construye SSML simple y robusto. Mantiene la semántica que ya venías
         usando (rate como factor p.ej. 1.2) y tono en porcentaje.
         """
-        tono_str = f"{tono:+d}%"
         # Nota: Azure acepta rate relativo como número (p.ej. "1.2") o porcentual ("+20%").
         # Dejamos el formato que vienes usando.
-        return f"""
-<speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xml:lang="es-CO">
-  <voice name="{voz}">
-    <prosody rate="{velocidad}" pitch="{tono_str}">
-      {texto}
-    </prosody>
-  </voice>
-</speak>
-        """.strip()
+        return _SSML_TEMPLATE.format(voz=voz, rate=velocidad, pitch=f"{tono:+d}%", body=texto)
 
     def _clean_text(self, texto: str) -> str:
         """
         Limpia/escapa solo lo necesario para telefonía en español colombiano.
-        Evita caracteres problemáticos y mejora pronunciación de abreviaturas.
+        Evita caracteres problemáticos, mejora pronunciación de abreviaturas y
+        agrega micro-pausas tras comas y antes del cierre de interrogación.
         """
-        import html
-
-        t = (texto or "").strip()
-        t = html.escape(t)
-
-        # Ajustes mínimos útiles en telefonía
-        replacements = {
-            "Dr.": "Doctor",
-            "Dra.": "Doctora",
-            "AM": "A M",
-            "PM": "P M",
-        }
-        for k, v in replacements.items():
-            t = t.replace(k, v)
-
-        # Pequeñas pausas naturales tras coma
-        t = t.replace(",", ", <break time='200ms'/>")
-
-        # Mantener signos de interrogación pero con una micro-pausa antes del cierre
-        if "?" in t:
-            t = t.replace("?", " <break time='250ms'/>?")
-
-        return t
+        t = (texto or "").strip().translate(_SSML_ESCAPE)
+        return _SSML_SUBS_RE.sub(lambda m: _SSML_SUBS[m.group(0)], t)
 
     # ---------------------------------------------------------------------
     # TOKENS EFÍMEROS PARA URLS /tts
@@ -182,29 +253,22 @@ class AzureVoiceProvider:
         /tts/{call_id}/{seq}?token={token}
         """
         expires = int(time.time()) + self.tts_token_ttl
-        message = f"{call_id}:{seq}:{expires}"
-        signature = hmac.new(
-            self.tts_secret.encode("utf-8"),
-            message.encode("utf-8"),
-            hashlib.sha256,
-        ).hexdigest()
-        return f"{expires}.{signature}"
+        return f"{expires}.{self._sign(f'{call_id}:{seq}:{expires}')}"
+
+    def _sign(self, message: str) -> str:
+        h = self._hmac_prototype.copy()
+        h.update(message.encode("utf-8"))
+        return h.hexdigest()
 
     def validate_tts_token(self, call_id: str, seq: int, token: str) -> bool:
-        """Valida el token efímero generado con create_tts_token."""
+        """Valida el token efímero generado con create_tts_token (tiempo constante: sin atajos por formato o expiración)."""
+        parse_ok = True
         try:
             expires_str, signature = token.split(".", 1)
             expires = int(expires_str)
-            if time.time() > expires:
-                return False
-
-            message = f"{call_id}:{seq}:{expires}"
-            expected = hmac.new(
-                self.tts_secret.encode("utf-8"),
-                message.encode("utf-8"),
-                hashlib.sha256,
-            ).hexdigest()
-
-            return hmac.compare_digest(signature, expected)
         except Exception:
-            return False
+            parse_ok, expires, signature = False, 0, "0" * 64
+
+        expected = self._sign(f"{call_id}:{seq}:{expires}")
+        sig_ok = hmac.compare_digest(signature.encode("utf-8", "replace"), expected.encode("ascii"))
+        return sig_ok & (time.time() <= expires) & parse_ok
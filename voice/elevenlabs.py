@@ -1,19 +1,39 @@
 import os
-import io
-import re
+import sys
 import time
 import hmac
-import json
 import struct
 import hashlib
 import logging
-from typing import Optional
-
+import warnings
+import functools
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, List, Tuple, AsyncIterator, Callable, Iterator
+
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import audioop  # eliminado en Python 3.13: se usa solo para relaciones de tasa no enteras
+except ImportError:
+    audioop = None
+
+import httpx
+import numpy as np
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .text import spoken_times
 
 logger = logging.getLogger(__name__)
 
 
+# Caracteres delatores de mojibake (el patrón AM/PM vive en voice/text.py)
+_MOJI_CHARS = frozenset("ÃÂâÎ")
+
+
 def _demojibake(text: str) -> str:
     """
     Repara texto típico con mojibake (UTF-8 leído como latin-1) sin afectar texto ya correcto.
@@ -21,28 +41,164 @@ def _demojibake(text: str) -> str:
     """
     if not text:
         return text
-    if any(ch in text for ch in ("Ã", "Â", "â", "Î")):
+    if not _MOJI_CHARS.isdisjoint(text):
         try:
             text = text.encode("latin-1").decode("utf-8")
         except Exception:
             pass
     
     # Corrección de AM/PM para mejor pronunciación
-    import re
-    # Captura tanto "AM/PM" como "a.m./p.m." con o sin espacios
-    text = re.sub(r'\b(\d{1,2}):?(\d{0,2})\s*(?:AM|a\.?\s*m\.?)\b', 
-                  lambda m: f"{m.group(1)}{':' + m.group(2) if m.group(2) else ''} de la mañana", 
-                  text, flags=re.IGNORECASE)
-    
-    text = re.sub(r'\b(\d{1,2}):?(\d{0,2})\s*(?:PM|p\.?\s*m\.?)\b', 
-                  lambda m: f"{m.group(1)}{':' + m.group(2) if m.group(2) else ''} de la tarde" 
-                           if int(m.group(1)) == 12 or int(m.group(1)) < 6 else 
-                           f"{m.group(1)}{':' + m.group(2) if m.group(2) else ''} de la noche", 
-                  text, flags=re.IGNORECASE)
+    text = spoken_times(text)
     
     return text
 
 
+# Timeout (conexión, lectura) de las peticiones síncronas. generate_audio bloquea el event loop de los webhooks:
+# peor caso con el reintento ≈ 2 + (2 + 4) s, por debajo de ~10 s y del presupuesto de ~15 s de Twilio
+_HTTP_TIMEOUT = (2.0, 4.0)
+
+# Sesiones HTTP reutilizadas por proceso (clave: api_key): urllib3 mantiene vivas las conexiones TLS
+_SESSIONS: Dict[str, requests.Session] = {}
+
+
+def _api_headers(api_key: str) -> Dict[str, str]:
+    return {
+        "xi-api-key": api_key,
+        "Content-Type": "application/json",
+        "Accept": "application/octet-stream",  # bytes crudos según output_format
+    }
+
+
+def _get_session(api_key: str) -> requests.Session:
+    session = _SESSIONS.get(api_key)
+    if session is None:
+        session = requests.Session()
+        session.headers.update(_api_headers(api_key))
+        # Reintentos con backoff exponencial ante fallos transitorios (POST incluido: la síntesis es idempotente)
+        # Un solo reintento, sin esperar el Retry-After de un 429 (podría bloquear el event loop durante segundos);
+        # un timeout de lectura no se reintenta: otro intento igual de lento excedería el presupuesto
+        retries = Retry(
+            total=1,
+            connect=1,
+            read=0,
+            status=1,
+            backoff_factor=0.2,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["POST"]),
+            respect_retry_after_header=False,
+            raise_on_status=False,  # agotados los reintentos, devolver la respuesta para loguear el error de la API
+        )
+        session.mount("https://", HTTPAdapter(max_retries=retries, pool_connections=4, pool_maxsize=16))
+        _SESSIONS[api_key] = session
+    return session
+
+
+# Cliente async compartido (HTTP/2) para el TTS en streaming; se crea al primer uso
+_ACLIENT: Optional[httpx.AsyncClient] = None
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    global _ACLIENT
+    if _ACLIENT is None:
+        _ACLIENT = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=16),
+            timeout=httpx.Timeout(45.0, connect=3.05),
+        )
+    return _ACLIENT
+
+
+async def aclose_async_client() -> None:
+    """Cierra el cliente async de streaming (llamar al apagar la app)."""
+    global _ACLIENT
+    if _ACLIENT is not None:
+        client, _ACLIENT = _ACLIENT, None
+        await client.aclose()
+
+
+# Cabecera WAV μ-law (fmt de 18 bytes + chunk fact): 58 bytes empaquetados en una sola llamada
+_WAV_ULAW_HDR = struct.Struct("<4sI4s4sIHHIIHHH4sII4sI")
+
+# Cabecera para μ-law en streaming: longitudes desconocidas (0xFFFFFFFF), los bytes crudos van detrás
+_ULAW_STREAM_HEADER = _WAV_ULAW_HDR.pack(
+    b"RIFF", 0xFFFFFFFF, b"WAVE", b"fmt ", 18, 0x0007, 1, 8000, 8000, 1, 8, 0,
+    b"fact", 4, 0xFFFFFFFF, b"data", 0xFFFFFFFF,
+)
+
+# Cabecera WAV PCM 16-bit canónica (fmt de 16 bytes, sin cbSize): 44 bytes
+_WAV_PCM16_HDR = struct.Struct("<4sI4s4sIHHIIHH4sI")
+
+# FIR paso bajo para decimar PCM a 8 kHz (sinc con ventana Hamming; sin scipy)
+_FIR_TAPS = 31
+
+
+@functools.lru_cache(maxsize=8)
+def _lowpass_taps(cutoff: float) -> "np.ndarray":
+    """Coeficientes con corte en `cutoff` ciclos/muestra (4 kHz relativos a la tasa de origen), ganancia DC = 1."""
+    n = np.arange(_FIR_TAPS, dtype=np.float64) - (_FIR_TAPS - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(_FIR_TAPS)
+    taps /= taps.sum()
+    taps = taps.astype(np.float32)
+    taps.flags.writeable = False
+    return taps
+
+
+# Caché LRU de audio por proceso: las mismas frases (confirmaciones, "¿podrías repetir?") se repiten entre llamadas.
+# Clave: (texto, voice_id, model_id, output_format, voice_settings). Solo se guardan respuestas exitosas.
+_AUDIO_CACHE_MAX = int(os.getenv("ELEVENLABS_AUDIO_CACHE_SIZE", "256"))
+_AUDIO_CACHE: "OrderedDict[Tuple, bytes]" = OrderedDict()
+_AUDIO_CACHE_LOCK = threading.Lock()
+
+
+def _audio_cache_get(key: Tuple) -> Optional[bytes]:
+    with _AUDIO_CACHE_LOCK:
+        audio = _AUDIO_CACHE.get(key)
+        if audio is not None:
+            _AUDIO_CACHE.move_to_end(key)
+        return audio
+
+
+def _audio_cache_put(key: Tuple, audio: bytes) -> None:
+    if _AUDIO_CACHE_MAX <= 0:
+        return
+    with _AUDIO_CACHE_LOCK:
+        _AUDIO_CACHE[key] = audio
+        _AUDIO_CACHE.move_to_end(key)
+        while len(_AUDIO_CACHE) > _AUDIO_CACHE_MAX:
+            _AUDIO_CACHE.popitem(last=False)
+
+
+# Prompts pre-generados (python -m voice.elevenlabs prebake prompts.txt): {hash}.wav en ELEVENLABS_CANNED_DIR.
+# hash = blake2b(texto, voice_id, model_id, output_format); se cargan una vez al importar el módulo.
+_CANNED_DIR = os.getenv("ELEVENLABS_CANNED_DIR", "canned_prompts")
+
+
+def _canned_hash(cache_key: Tuple) -> str:
+    txt, voice_id, model_id, out_fmt = cache_key[:4]
+    return hashlib.blake2b("\x1f".join((txt, voice_id, model_id, out_fmt)).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _load_canned(directory: str) -> Dict[str, bytes]:
+    canned: Dict[str, bytes] = {}
+    if not os.path.isdir(directory):
+        return canned
+    for name in os.listdir(directory):
+        stem, ext = os.path.splitext(name)
+        if ext == ".wav":
+            with open(os.path.join(directory, name), "rb") as f:
+                canned[stem] = f.read()
+    if canned:
+        logger.info(f"ElevenLabs: {len(canned)} prompts pre-generados cargados desde {directory}")
+    return canned
+
+
+_CANNED: Dict[str, bytes] = _load_canned(_CANNED_DIR)
+
+
+def _canned_get(cache_key: Tuple) -> Optional[bytes]:
+    return _CANNED.get(_canned_hash(cache_key)) if _CANNED else None
+
+
 class ElevenLabsVoiceProvider:
     """
     Cliente ElevenLabs TTS que devuelve WAV listo para Twilio <Play>.
@@ -65,6 +221,9 @@ class ElevenLabsVoiceProvider:
         # Seguridad para endpoints efímeros /audio
         self.tts_secret = os.getenv("TTS_SECRET", "change-me-in-production")
         self.tts_token_ttl = int(os.getenv("TTS_TOKEN_TTL_SECONDS", "300"))  # 5 min
+        # HMAC con la clave ya cargada: cada firma copia la plantilla en vez de recalcular los pads
+        self._tts_secret_bytes = self.tts_secret.encode("utf-8")
+        self._hmac_template = hmac.new(self._tts_secret_bytes, b"", hashlib.sha256)
 
         self.configured = True
         self.config_error = None
@@ -75,6 +234,33 @@ class ElevenLabsVoiceProvider:
             self.configured = False
             self.config_error = "ELEVENLABS_VOICE_ID no configurada"
 
+        # Partes fijas de la petición: solo "text" cambia entre llamadas.
+        # output_format va en la query: en el cuerpo JSON ElevenLabs lo ignora y responde su MP3 por defecto
+        self._tts_url = (
+            f"https://api.elevenlabs.io/v1/text-to-speech/{self.voice_id}/stream"
+            f"?output_format={self.preferred_output_format}"
+        )
+        voice_settings = {
+            "stability": 0.35,
+            "similarity_boost": 0.92,
+            "style": 0.80,
+            "use_speaker_boost": True,
+            "speed": 1.18,
+        }
+        self._base_payload = {
+            "model_id": self.model_id,
+            "voice_settings": voice_settings,
+        }
+        self._settings_key = tuple(voice_settings.items())
+
+        # Conversión a WAV según el formato configurado (resuelta una vez, no por llamada)
+        self._postprocess, self._stream_prefix, self._mime_type = self._pick_postprocessor(self.preferred_output_format)
+
+        # Sesión persistente compartida por proceso (app.py crea un provider por llamada)
+        self._session = _get_session(self.api_key)
+        # Cabeceras explícitas para httpx (las de requests.Session traen su User-Agent/Connection por defecto)
+        self._headers = _api_headers(self.api_key)
+
         if self.configured:
             logger.info(f"ElevenLabs listo · voice_id={self.voice_id} · model={self.model_id} · out={self.preferred_output_format}")
         else:
@@ -94,49 +280,31 @@ class ElevenLabsVoiceProvider:
         Devuelve WAV (8 kHz mono) listo para <Play> de Twilio.
         Si ElevenLabs falla o devuelve formato inesperado, retorna None.
         """
+        if not texto or texto.isspace():
+            return None
         if not self.configured:
             logger.error(f"ElevenLabs generate_audio: config inválida: {self.config_error}")
             return None
 
-        txt = _demojibake((texto or "").strip())
-        if not txt:
-            logger.warning("ElevenLabs generate_audio: texto vacío")
+        prepared = self._prepare_request(texto)
+        if prepared is None:
             return None
+        payload, cache_key = prepared
 
-        # Mapear velocidad/tono a settings (0..1)
-        try:
-            stability = max(0.0, min(1.0, 0.6 + (float(velocidad) - 1.2) * 0.5))
-        except Exception:
-            stability = 0.6
-        try:
-            style = max(0.0, min(1.0, 0.55 + (int(tono) / 20.0) * 0.25))
-        except Exception:
-            style = 0.6
+        cached = self._lookup_cached(cache_key)
+        if cached is not None:
+            return cached
 
-        out_fmt = self.preferred_output_format
-        payload = {
-            "text": txt,
-            "model_id": self.model_id,
-            "voice_settings": {
-                "stability": 0.35,
-                "similarity_boost": 0.92 ,
-                "style": 0.80,
-                "use_speaker_boost": True,
-                "speed": 1.18
-            },
-            "output_format": out_fmt,  # "pcm_16000" (default) | "ulaw_8000"
-        }
-        logger.info("ElevenLabs request payload: %s", json.dumps(payload, ensure_ascii=False))
+        body = orjson.dumps(payload)
+        # Solo la forma de la petición (sin el texto del paciente) y solo en DEBUG
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("ElevenLabs payload keys=%s text_len=%d body=%d bytes", list(payload), len(payload["text"]), len(body))
 
-        url = f"https://api.elevenlabs.io/v1/text-to-speech/{self.voice_id}/stream"
-        headers = {
-            "xi-api-key": self.api_key,
-            "Content-Type": "application/json",
-            "Accept": "application/octet-stream",  # bytes crudos según output_format
-        }
+        url = self._tts_url
 
         try:
-            resp = requests.post(url, headers=headers, data=json.dumps(payload), timeout=45)
+            # timeout (conexión, lectura)
+            resp = self._session.post(url, data=body, timeout=_HTTP_TIMEOUT)
         except Exception as e:
             logger.error("ElevenLabs request error: %s", e)
             return None
@@ -151,65 +319,238 @@ class ElevenLabsVoiceProvider:
             return None
 
         audio_bytes = resp.content or b""
-        return audio_bytes
-        """if not audio_bytes:
+        if not audio_bytes:
             logger.error("ElevenLabs devolvió audio vacío")
             return None
 
-        # Si ya es WAV, úsalo tal cual
-        if self._looks_like_wav(audio_bytes):
-            logger.info("ElevenLabs: audio ya es WAV; tamaño=%d", len(audio_bytes))
-            return audio_bytes
+        audio = self._convert(audio_bytes, resp.headers.get("Content-Type"))
+        if audio:
+            _audio_cache_put(cache_key, audio)
+        return audio
 
-        # Ruta μ-law 8 kHz -> encapsular a WAV formato=7 con chunk fact
-        if out_fmt.startswith("ulaw"):
-            wav = self._wrap_ulaw_to_wav(audio_bytes, sample_rate=8000, channels=1)
-            logger.info("Encapsulado μ-law RAW -> WAV (formato 7 + fact); bytes=%d", len(wav))
-            return wav
+    def _prepare_request(self, texto: str) -> Optional[Tuple[Dict, Tuple]]:
+        """
+        Payload de ElevenLabs y clave de caché para un texto; None si el texto queda vacío.
+        Los voice_settings son fijos (velocidad/tono de la API pública no se mapean).
+        """
+        txt = _demojibake((texto or "").strip())
+        if not txt:
+            logger.warning("ElevenLabs: texto vacío")
+            return None
 
-        # Ruta PCM 16 kHz crudo -> WAV PCM 8 kHz mono
-        if out_fmt.startswith("pcm"):
-            try:
-                src_rate = self._parse_rate_from_pcm_format(out_fmt) or 16000
-                wav = self._pcm16le_to_wav_8k(audio_bytes, src_rate)
-                logger.info("Convertido PCM16 raw %dk -> WAV PCM 8k; bytes=%d", src_rate // 1000, len(wav))
-                return wav
-            except Exception as e:
-                logger.error("Error convirtiendo PCM16 a WAV 8k: %s", e)
-                return None
-
-        # Otros formatos no soportados en este flujo
-        logger.error("Formato de salida no soportado para telefonía: %s", out_fmt)
-        return None"""
+        payload = {**self._base_payload, "text": txt}
+        cache_key = (txt, self.voice_id, self.model_id, self.preferred_output_format, self._settings_key)
+        return payload, cache_key
+
+    def _begin_stream(self, texto: str, caller: str) -> Optional[Tuple[Dict, Tuple, Optional[bytes]]]:
+        """
+        Pasos previos comunes a los generadores en streaming: guardas, payload y búsqueda en caché.
+        Devuelve (payload, cache_key, audio_cacheado) o None si no hay nada que sintetizar.
+        """
+        if not texto or texto.isspace():
+            return None
+        if not self.configured:
+            logger.error(f"ElevenLabs {caller}: config inválida: {self.config_error}")
+            return None
+
+        prepared = self._prepare_request(texto)
+        if prepared is None:
+            return None
+        payload, cache_key = prepared
+        return payload, cache_key, self._lookup_cached(cache_key)
+
+    @staticmethod
+    def _lookup_cached(cache_key: Tuple) -> Optional[bytes]:
+        cached = _canned_get(cache_key) or _audio_cache_get(cache_key)
+        if cached is not None:
+            logger.info("ElevenLabs cache hit: %d bytes", len(cached))
+        return cached
+
+    def _stream_head(self, content_type: Optional[str], first: bytes) -> Optional[bytes]:
+        """
+        Cabecera a emitir antes del primer fragmento, decidida con los bytes reales: b"" si ElevenLabs
+        manda MP3 (se reenvía tal cual), si no la del formato configurado (None = bufferizar y convertir al final).
+        """
+        if "mpeg" in (content_type or "") or self._looks_like_mp3(first):
+            return b""
+        return self._stream_prefix
+
+    def _finish_stream(self, chunks: List[bytes], cache_key: Tuple, content_type: Optional[str]) -> Optional[bytes]:
+        """Convierte y cachea el audio acumulado de un stream; None si no llegó nada utilizable."""
+        if not chunks:
+            return None
+        audio = self._convert(b"".join(chunks), content_type)
+        if audio:
+            _audio_cache_put(cache_key, audio)
+        return audio
+
+    def generate_audio_chunks(self, texto: str, chunk_size: int = 4096) -> Iterator[bytes]:
+        """
+        Versión síncrona de generate_audio_stream(): lee la respuesta con iter_content en vez de
+        bufferizar resp.content, así el primer chunk sale con el primer byte de ElevenLabs.
+        En μ-law emite primero una cabecera WAV con longitud indefinida y luego los bytes crudos.
+        """
+        begun = self._begin_stream(texto, "generate_audio_chunks")
+        if begun is None:
+            return
+        payload, cache_key, cached = begun
+        if cached is not None:
+            yield cached
+            return
+
+        prefix = self._stream_prefix
+        chunks: List[bytes] = []
+        try:
+            with self._session.post(self._tts_url, data=orjson.dumps(payload), timeout=_HTTP_TIMEOUT, stream=True) as resp:
+                logger.info("ElevenLabs stream response: status=%s", resp.status_code)
+                if resp.status_code != 200:
+                    logger.error("ElevenLabs API error %s: %s", resp.status_code, resp.text[:500])
+                    return
+                content_type = resp.headers.get("Content-Type")
+                for chunk in resp.iter_content(chunk_size=chunk_size):
+                    if not chunk:
+                        continue
+                    if not chunks:
+                        prefix = self._stream_head(content_type, chunk)
+                        if prefix:
+                            yield prefix
+                    chunks.append(chunk)
+                    if prefix is not None:
+                        yield chunk
+        except Exception as e:
+            logger.error("ElevenLabs stream error: %s", e)
+            return
+
+        audio = self._finish_stream(chunks, cache_key, content_type)
+        # Formatos que no admiten streaming (PCM a remuestrear): se emite el WAV completo al final
+        if audio and prefix is None:
+            yield audio
+
+    async def generate_audio_stream(self, texto: str, audio_out: Optional[Dict[str, bytes]] = None) -> AsyncIterator[bytes]:
+        """
+        Igual que generate_audio(), pero asíncrono y en streaming: emite los bytes a medida
+        que ElevenLabs los envía, para empezar a reproducir antes de tener todo el audio.
+        Al completar, guarda el audio en la caché compartida con generate_audio().
+        Si se pasa audio_out, solo cuando el stream termina bien se llena audio_out["audio"] con el WAV completo.
+        """
+        begun = self._begin_stream(texto, "generate_audio_stream")
+        if begun is None:
+            return
+        payload, cache_key, cached = begun
+        if cached is not None:
+            if audio_out is not None:
+                audio_out["audio"] = cached
+            yield cached
+            return
+
+        prefix = self._stream_prefix
+        chunks: List[bytes] = []
+        try:
+            async with _get_async_client().stream("POST", self._tts_url, content=orjson.dumps(payload), headers=self._headers) as resp:
+                logger.info("ElevenLabs stream response: status=%s", resp.status_code)
+                if resp.status_code != 200:
+                    err = (await resp.aread())[:500]
+                    logger.error("ElevenLabs API error %s: %s", resp.status_code, err)
+                    return
+                content_type = resp.headers.get("Content-Type")
+                async for chunk in resp.aiter_bytes(4096):
+                    if not chunks:
+                        prefix = self._stream_head(content_type, chunk)
+                        if prefix:
+                            yield prefix
+                    chunks.append(chunk)
+                    if prefix is not None:
+                        yield chunk
+        except Exception as e:
+            logger.error("ElevenLabs stream error: %s", e)
+            return
+
+        audio = self._finish_stream(chunks, cache_key, content_type)
+        if audio and audio_out is not None:
+            audio_out["audio"] = audio
+        # Formatos que no admiten streaming (PCM a remuestrear): se emite el WAV completo al final
+        if audio and prefix is None:
+            yield audio
+
+    def close(self) -> None:
+        """Cierra el pool de conexiones HTTP (compartido: usar solo al apagar el proceso)."""
+        _SESSIONS.pop(self.api_key, None)
+        self._session.close()
 
     # ------------------------------------------------------------------
     # Tokens efímeros (mismo contrato que AzureVoiceProvider)
     # ------------------------------------------------------------------
     def create_tts_token(self, call_id: str, seq: int) -> str:
         expires = int(time.time()) + self.tts_token_ttl
-        message = f"{call_id}:{seq}:{expires}"
-        signature = hmac.new(
-            self.tts_secret.encode("utf-8"),
-            message.encode("utf-8"),
-            hashlib.sha256,
-        ).hexdigest()
+        signature = self._sign(f"{call_id}:{seq}:{expires}")
         return f"{expires}.{signature}"
 
+    def _sign(self, message: str) -> str:
+        h = self._hmac_template.copy()
+        h.update(message.encode("utf-8"))
+        return h.hexdigest()
+
     def validate_tts_token(self, call_id: str, seq: int, token: str) -> bool:
+        # Tiempo constante: la firma se calcula siempre y los resultados se combinan sin cortocircuito
+        parse_ok = True
         try:
             expires_str, signature = token.split(".", 1)
             expires = int(expires_str)
-            if time.time() > expires:
-                return False
-            message = f"{call_id}:{seq}:{expires}"
-            expected = hmac.new(
-                self.tts_secret.encode("utf-8"),
-                message.encode("utf-8"),
-                hashlib.sha256,
-            ).hexdigest()
-            return hmac.compare_digest(signature, expected)
         except Exception:
-            return False
+            parse_ok, expires, signature = False, 0, "0" * 64
+
+        expected = self._sign(f"{call_id}:{seq}:{expires}")
+        sig_ok = hmac.compare_digest(signature.encode("utf-8", "replace"), expected.encode("ascii"))
+        return sig_ok & (time.time() <= expires) & parse_ok
+
+    # ------------------------------------------------------------------
+    # Post-proceso por formato de salida
+    # ------------------------------------------------------------------
+    def _pick_postprocessor(self, out_fmt: str) -> Tuple[Callable[[bytes], Optional[bytes]], Optional[bytes], str]:
+        """
+        (postprocess, stream_prefix, mime_type) para out_fmt:
+          - postprocess: bytes crudos de ElevenLabs -> audio listo para <Play>
+          - stream_prefix: cabecera a emitir antes de los bytes crudos en streaming;
+            None si el formato exige el audio completo para convertirlo
+        """
+        # Ruta μ-law 8 kHz -> encapsular a WAV formato=7 con chunk fact
+        if out_fmt.startswith("ulaw"):
+            return self._ulaw_postprocess, _ULAW_STREAM_HEADER, "audio/wav"
+
+        # Ruta PCM 16 kHz crudo -> WAV PCM 8 kHz mono
+        if out_fmt.startswith("pcm"):
+            src_rate = self._parse_rate_from_pcm_format(out_fmt) or 16000
+            return functools.partial(self._pcm_postprocess, src_rate=src_rate), None, "audio/wav"
+
+        # Otros formatos (mp3_*): se sirven tal cual
+        logger.warning("Formato de salida sin conversión para telefonía: %s", out_fmt)
+        return (lambda audio_bytes: audio_bytes), b"", "audio/mpeg"
+
+    def _convert(self, audio_bytes: bytes, content_type: Optional[str] = None) -> Optional[bytes]:
+        """
+        Audio listo para <Play>. Si ElevenLabs respondió MP3 (p. ej. ignoró output_format),
+        se devuelve tal cual en vez de envolverlo en una cabecera WAV que no le corresponde.
+        """
+        if "mpeg" in (content_type or "") or self._looks_like_mp3(audio_bytes):
+            if self._mime_type != "audio/mpeg":
+                logger.warning("ElevenLabs devolvió MP3 en vez de %s: se sirve sin conversión", self.preferred_output_format)
+            return audio_bytes
+        return self._postprocess(audio_bytes)
+
+    def _ulaw_postprocess(self, audio_bytes: bytes) -> bytes:
+        # Si ya es WAV, úsalo tal cual
+        if self._looks_like_wav(audio_bytes):
+            return audio_bytes
+        return self._wrap_ulaw_to_wav(audio_bytes, sample_rate=8000, channels=1)
+
+    def _pcm_postprocess(self, audio_bytes: bytes, src_rate: int) -> Optional[bytes]:
+        if self._looks_like_wav(audio_bytes):
+            return audio_bytes
+        try:
+            return self._pcm16le_to_wav_8k(audio_bytes, src_rate)
+        except Exception as e:
+            logger.error("Error convirtiendo PCM16 a WAV 8k: %s", e)
+            return None
 
     # ------------------------------------------------------------------
     # Helpers de formato
@@ -218,6 +559,16 @@ class ElevenLabsVoiceProvider:
     def _looks_like_wav(data: bytes) -> bool:
         return len(data) >= 12 and data[:4] == b"RIFF" and data[8:12] == b"WAVE"
 
+    @staticmethod
+    def _looks_like_mp3(data: bytes) -> bool:
+        """Etiqueta ID3 o cabecera de frame MPEG válida (sync de 11 bits + versión/capa/bitrate/tasa no reservados)."""
+        if data[:3] == b"ID3":
+            return True
+        if len(data) < 3 or data[0] != 0xFF or data[1] & 0xE0 != 0xE0:
+            return False
+        # Descarta p. ej. silencio μ-law (0xFF 0xFF 0xFF...), que también empieza con 11 bits en 1
+        return (data[1] >> 3) & 3 != 1 and (data[1] >> 1) & 3 != 0 and data[2] >> 4 != 0xF and (data[2] >> 2) & 3 != 3
+
     @staticmethod
     def _parse_rate_from_pcm_format(fmt: str) -> Optional[int]:
         # "pcm_16000", "pcm_22050", etc.
@@ -240,64 +591,117 @@ class ElevenLabsVoiceProvider:
         data_chunk_size = num_samples
         riff_size = 4 + (8 + fmt_chunk_size) + (8 + fact_chunk_size) + (8 + data_chunk_size)
 
-        header = (
-            b"RIFF" +
-            struct.pack("<I", riff_size) +
-            b"WAVE" +
-            b"fmt " +
-            struct.pack("<I", fmt_chunk_size) +
-            struct.pack("<H", 0x0007) +                 # WAVE_FORMAT_MULAW
-            struct.pack("<H", channels) +
-            struct.pack("<I", sample_rate) +
-            struct.pack("<I", byte_rate) +
-            struct.pack("<H", block_align) +
-            struct.pack("<H", 8) +                      # BitsPerSample
-            struct.pack("<H", 0) +                      # cbSize
-            b"fact" +
-            struct.pack("<I", fact_chunk_size) +
-            struct.pack("<I", num_samples) +            # dwSampleLength
-            b"data" +
-            struct.pack("<I", data_chunk_size)
+        return _WAV_ULAW_HDR.pack(
+            b"RIFF", riff_size, b"WAVE",
+            b"fmt ", fmt_chunk_size,
+            0x0007,                                     # WAVE_FORMAT_MULAW
+            channels, sample_rate, byte_rate, block_align,
+            8,                                          # BitsPerSample
+            0,                                          # cbSize
+            b"fact", fact_chunk_size, num_samples,      # dwSampleLength
+            b"data", data_chunk_size,
         )
-        return header
 
     def _wrap_ulaw_to_wav(self, ulaw_bytes: bytes, sample_rate: int = 8000, channels: int = 1) -> bytes:
         return self._build_wav_header_mulaw_with_fact(len(ulaw_bytes), sample_rate, channels) + ulaw_bytes
 
     @staticmethod
-    def _pcm16le_to_wav_8k(pcm16le_src: bytes, src_rate: int) -> bytes:
+    def _build_wav_header_pcm16(num_bytes: int, sample_rate: int = 8000, channels: int = 1) -> bytes:
+        """WAV PCM lineal 16-bit (WAVE_FORMAT_PCM=0x0001), cabecera canónica de 44 bytes."""
+        block_align = 2 * channels
+        return _WAV_PCM16_HDR.pack(
+            b"RIFF", 36 + num_bytes, b"WAVE",
+            b"fmt ", 16,
+            0x0001,                                     # WAVE_FORMAT_PCM
+            channels, sample_rate, sample_rate * block_align, block_align,
+            16,                                         # BitsPerSample
+            b"data", num_bytes,
+        )
+
+    @classmethod
+    def _pcm16le_to_wav_8k(cls, pcm16le_src: bytes, src_rate: int) -> bytes:
         """
         Convierte PCM lineal 16-bit LE mono a WAV PCM 8 kHz mono.
-        Downsample simple por decimación; suficiente para voz telefónica.
+        Downsample por decimación con filtro anti-alias FIR (31 taps), suficiente para voz telefónica.
         """
         if not pcm16le_src:
             return b""
+        samples = np.frombuffer(pcm16le_src, dtype="<i2", count=len(pcm16le_src) // 2)
         if src_rate == 8000:
-            pcm8k = pcm16le_src
+            pcm8k = samples.tobytes()
+        elif src_rate % 8000 == 0 or audioop is None:
+            # Decimación por factor entero
+            # (si no es múltiplo exacto y no hay audioop, elegimos el más cercano)
+            factor = max(1, int(round(src_rate / 8000.0)))
+            if factor == 1:
+                pcm8k = samples.tobytes()
+            else:
+                # Filtro anti-alias FIR evaluado solo en las muestras que se conservan (grilla decimada)
+                taps = _lowpass_taps(0.5 / factor)
+                half = len(taps) // 2
+                padded = np.pad(samples.astype(np.float32), (half, half))
+                windows = np.lib.stride_tricks.sliding_window_view(padded, len(taps))[::factor]
+                filtered = windows @ taps
+                pcm8k = np.clip(np.rint(filtered), -32768, 32767).astype("<i2").tobytes()
         else:
-            # Decimación por factor entero aproximado
-            # (si no es múltiplo exacto, elegimos el más cercano)
-            import math
-            factor = int(round(src_rate / 8000.0))
-            factor = max(1, factor)
-            step = 2 * factor  # 2 bytes por muestra * factor
-            pcm8k = bytearray()
-            for i in range(0, len(pcm16le_src), step):
-                pcm8k += pcm16le_src[i:i+2]
-
-        out = io.BytesIO()
-        import wave as _wave
-        with _wave.open(out, "wb") as w:
-            w.setnchannels(1)
-            w.setsampwidth(2)   # 16-bit
-            w.setframerate(8000)
-            w.writeframes(bytes(pcm8k))
-        return out.getvalue()
+            # Relación no entera (22050, 44100): ratecv (C) llega exacto a 8 kHz, pero no filtra;
+            # el FIR anti-alias se aplica antes, a la tasa de origen
+            filtered = np.convolve(samples.astype(np.float32), _lowpass_taps(4000.0 / src_rate), mode="same")
+            pcm = np.clip(np.rint(filtered), -32768, 32767).astype("<i2").tobytes()
+            pcm8k, _ = audioop.ratecv(pcm, 2, 1, src_rate, 8000, None)
+
+        return cls._build_wav_header_pcm16(len(pcm8k)) + pcm8k
 
     # (Opcional)
     def get_provider_name(self) -> str:
         return "elevenlabs"
 
-    def get_mime_type(self) -> str:
-        return "audio/mpeg"
+    def get_mime_type(self, audio: Optional[bytes] = None) -> str:
+        """MIME del formato configurado o, si se pasa audio, el que corresponde a sus bytes."""
+        if audio:
+            if self._looks_like_wav(audio):
+                return "audio/wav"
+            if self._looks_like_mp3(audio):
+                return "audio/mpeg"
+        return self._mime_type
     
+
+
+# ----------------------------------------------------------------------
+# CLI: python -m voice.elevenlabs prebake prompts.txt [directorio]
+# ----------------------------------------------------------------------
+def _prebake(prompts_path: str, directory: str) -> int:
+    """Genera {hash}.wav para cada línea no vacía de prompts_path con la voz/modelo/formato configurados."""
+    provider = ElevenLabsVoiceProvider()
+    if not provider.configured:
+        return 1
+    os.makedirs(directory, exist_ok=True)
+    with open(prompts_path, encoding="utf-8") as f:
+        prompts = [line.strip() for line in f if line.strip()]
+
+    failed = 0
+    for texto in prompts:
+        prepared = provider._prepare_request(texto)
+        if prepared is None:
+            continue
+        path = os.path.join(directory, f"{_canned_hash(prepared[1])}.wav")
+        if os.path.exists(path):
+            logger.info(f"Ya existe: {texto!r}")
+            continue
+        audio = provider.generate_audio(texto)
+        if not audio:
+            logger.error(f"❌ No se pudo generar: {texto!r}")
+            failed += 1
+            continue
+        with open(path, "wb") as out:
+            out.write(audio)
+        logger.info(f"✅ {texto!r} -> {path} ({len(audio)} bytes)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 3 or sys.argv[1] != "prebake":
+        print("Uso: python -m voice.elevenlabs prebake prompts.txt [directorio]")
+        sys.exit(2)
+    sys.exit(_prebake(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else _CANNED_DIR))
@@ -0,0 +1,20 @@
+# text.py
+# Normalización de texto para TTS compartida por app.py, voice/elevenlabs.py y scheduler/openia.py
+
+import re
+
+# Captura tanto "AM/PM" como "a.m./p.m." con o sin espacios, en una sola pasada
+TIME_RE = re.compile(r'\b(?P<h>\d{1,2}):?(?P<m>\d{0,2})\s*(?P<ap>AM|a\.?\s*m\.?|PM|p\.?\s*m\.?)\b', re.IGNORECASE)
+
+
+def _time_repl(m: "re.Match") -> str:
+    h = m.group("h")
+    hora = f"{h}:{m.group('m')}" if m.group("m") else h
+    if m.group("ap")[0] in "aA":
+        return f"{hora} de la mañana"
+    return f"{hora} de la tarde" if int(h) == 12 or int(h) < 6 else f"{hora} de la noche"
+
+
+def spoken_times(text: str) -> str:
+    """Corrección de AM/PM para mejor pronunciación: '8:00 a. m.' -> '8:00 de la mañana'."""
+    return TIME_RE.sub(_time_repl, text)